@@ -5,14 +5,35 @@ import logging
 import json
 import time
 import re
+import copy
+import bisect
+import mimetypes
+import math
+import heapq
+import hashlib
+import hmac
+import random
+import sqlite3
+import signal
+import atexit
+import queue
 import requests
-from threading import Lock
-from flask import Flask, request
+import urllib3
+from datetime import datetime
+from collections import deque, OrderedDict
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from threading import Lock, Condition, Thread, Event, local
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from flask import Flask, Request, request
+from werkzeug.exceptions import RequestEntityTooLarge
+from waitress import create_server
 
 print("GAJA BOT - MERGED: WARRANTY (KISS) + CASHBACK + FIXED FLOW")
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
 logger = logging.getLogger(__name__)
-logger.info("GAJA BOT STARTING - MERGED BUILD")
+PROCESS_STARTED = time.time()
 
 # ==================== CONFIG ====================
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
@@ -27,9 +48,230 @@ CATALOG_FILENAME = os.getenv("CATALOG_FILENAME", "GAJA-Catalogue.pdf")
 PUMBLE_WEBHOOK = os.getenv("PUMBLE_WEBHOOK_URL", "")
 SCHEME_IMAGES = [os.getenv(k) for k in ["SCHEME_IMG1","SCHEME_IMG2","SCHEME_IMG3","SCHEME_IMG4","SCHEME_IMG5"] if os.getenv(k)]
 
-GRAPH = "https://graph.facebook.com/v20.0"
+GRAPH = os.getenv("GRAPH_URL", "https://graph.facebook.com/v20.0")  # overridable for a local stand-in
 HEADERS = {"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"}
 SESSION_TIMEOUT = 180  # 3 minutes
+SESSION_MAX = int(os.getenv("SESSION_MAX", 20000))  # least recently used sessions are evicted past this
+SESSION_SWEEP_INTERVAL = 30  # seconds between background expiry sweeps
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "gaja_jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))  # 0 = process inline (debug only)
+JOB_MAX_ATTEMPTS = 3  # a job that keeps killing the process is dropped after this many starts
+DEDUP_TTL = 600  # seconds a message ID is remembered (Meta retries well within this)
+DEDUP_MAX = int(os.getenv("DEDUP_MAX", 50000))  # hard cap on remembered message IDs
+CACHE_MAX = int(os.getenv("CACHE_MAX", 5000))  # cached Apps Script responses, LRU beyond this
+# Apps Script actions served through the read-through cache: (found TTL, not-found TTL) in seconds
+CACHE_TTLS = {
+    "lookup_barcode": (3600, 300),
+    "get_care_instructions": (6 * 3600, 600),
+    "months": (3600, 0),
+    "cashback": (600, 120),
+    "verify_token": (0, 120),  # availability flips on registration, so only invalid tokens are remembered
+}
+CACHE_STALE_FOR = 6 * 3600  # an expired entry may still be served this long when Apps Script is failing
+API_TIMEOUT_MIN = 1.5  # adaptive per-action timeout bounds, seconds (the old flat timeout was 10)
+API_TIMEOUT_MAX = float(os.getenv("API_TIMEOUT_MAX", 10))
+API_TIMEOUT_FACTOR = 3  # timeout = observed p99 x this, once an action has API_LATENCY_MIN_SAMPLES
+API_LATENCY_MIN_SAMPLES = 20
+API_READ_ACTIONS = {"verify_token", "lookup_barcode", "get_care_instructions", "months", "cashback"}  # plus export_*
+HEDGED_ACTIONS = {"verify_token", "lookup_barcode", "months", "cashback"}  # idempotent reads
+HEDGE_MIN_DELAY = 0.25  # never hedge sooner than this, seconds
+BREAKER_WINDOW = 20  # recent calls per action the breaker looks at
+BREAKER_MIN_CALLS = 10  # ...and only once it has seen this many
+BREAKER_ERROR_RATE = 0.5  # open when this share of the window failed
+BREAKER_COOLDOWN = 30  # seconds open before a single probe call is let through
+REPLICA_SYNC_INTERVAL = int(os.getenv("REPLICA_SYNC_INTERVAL", 900))  # seconds between delta syncs, 0 = off
+REPLICA_FULL_SYNC_EVERY = 24  # every Nth sync is a full reload, dropping anything a delta missed
+TOKEN_FILTER_FP_RATE = 0.001  # Bloom filter sizing target for the issued-token set
+TOKEN_FILTER_MAX_AGE = 3 * 3600  # an older filter is not trusted to reject tokens locally
+PUMBLE_BATCH_SIZE = int(os.getenv("PUMBLE_BATCH_SIZE", 20))  # events per Pumble post
+PUMBLE_FLUSH_INTERVAL = float(os.getenv("PUMBLE_FLUSH_INTERVAL", 5))  # max seconds an event waits in the buffer
+PUMBLE_QUEUE_MAX = 1000  # buffered events beyond this are dropped (and counted)
+PUMBLE_RETRIES = 3
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", 8))  # 0 = send inline on the turn's thread
+GRAPH_RATE = float(os.getenv("GRAPH_RATE", 60))  # messages/second allowed per PHONE_NUMBER_ID
+GRAPH_BURST = int(os.getenv("GRAPH_BURST", 60))
+GRAPH_MAX_RETRIES = 6  # throttled sends are retried this many times before giving up
+GRAPH_THROTTLE_CODES = {4, 80007, 130429, 131048, 131056}  # Graph error codes that mean "slow down"
+MEDIA_TTL = 29 * 24 * 3600  # Graph keeps uploaded media for 30 days; treat IDs as expired a day early
+MEDIA_REFRESH_MARGIN = 2 * 24 * 3600  # re-upload proactively once an ID is this close to expiry
+MEDIA_ERROR_CODES = {131052, 131053}  # Graph's media download/upload errors: our media ID may be gone
+MEDIA_FAILURE_BACKOFF = 300  # after a failed upload a URL is sent by link this long, doubling per failure
+MEDIA_FAILURE_BACKOFF_MAX = 6 * 3600
+STATUS_TRACK_MAX = int(os.getenv("STATUS_TRACK_MAX", 50000))  # sent message IDs awaiting status callbacks
+STATUS_TRACK_TTL = 24 * 3600  # stop waiting for a status after this long
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds, /metrics latency histograms
+WARRANTY_WRITE_BEHIND = os.getenv("WARRANTY_WRITE_BEHIND", "1") == "1"  # 0 = register with Apps Script inside the turn
+WARRANTY_COMMIT_BATCH = int(os.getenv("WARRANTY_COMMIT_BATCH", 20))  # journaled registrations sent per committer pass
+WARRANTY_COMMIT_INTERVAL = float(os.getenv("WARRANTY_COMMIT_INTERVAL", 2))  # max seconds a registration waits for a pass
+WARRANTY_RETRY_MAX = 600  # backoff cap, seconds, between attempts at a registration Apps Script did not answer
+WARRANTY_JOURNAL_KEEP = 7 * 24 * 3600  # committed registrations are kept (and their tokens blocked) this long
+IO_WORKERS = int(os.getenv("IO_WORKERS", 16))  # threads for a turn's independent upstream calls, 0 = run them in turn
+SENDER_RATE = float(os.getenv("SENDER_RATE", 0.5))  # sustained messages/second admitted per phone number
+SENDER_BURST = float(os.getenv("SENDER_BURST", 15))
+GLOBAL_RATE = float(os.getenv("GLOBAL_RATE", 100))  # messages/second admitted across all senders
+GLOBAL_BURST = float(os.getenv("GLOBAL_BURST", 300))
+LOOKUP_COST = 3  # tokens charged for a message that will reach Apps Script (warranty token, 6-digit code)
+ADMISSION_MAX_SENDERS = 50000  # sender buckets kept, least recently active dropped first
+THROTTLE_NOTICE_INTERVAL = 60  # seconds between "slow down" replies to the same sender
+WEB_THREADS = int(os.getenv("WEB_THREADS", 8))  # waitress request threads (webhook acks only, turns run on JOB_WORKERS)
+WEB_CONNECTION_LIMIT = int(os.getenv("WEB_CONNECTION_LIMIT", 200))  # open connections before new ones wait in the backlog
+WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", 1024))  # listen() backlog
+WEB_CHANNEL_TIMEOUT = int(os.getenv("WEB_CHANNEL_TIMEOUT", 60))  # idle keep-alive connections are closed after this
+SHUTDOWN_GRACE = float(os.getenv("SHUTDOWN_GRACE", 25))  # seconds to drain turns and sends after SIGTERM
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # bearer token for the /campaigns API; unset = the API refuses every call
+CAMPAIGN_WORKERS = int(os.getenv("CAMPAIGN_WORKERS", 16))  # concurrent broadcast sends (Graph round trips), 0 = off
+CAMPAIGN_RESERVE = 10  # tokens of the PHONE_NUMBER_ID bucket a broadcast never takes, kept for conversations
+CAMPAIGN_CHECKPOINT_INTERVAL = 1.0  # seconds between writes of broadcast progress
+CAMPAIGN_MAX_RECIPIENTS = 100000
+WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", 1024 * 1024))  # larger deliveries are refused unread (413)
+WARMUP = os.getenv("WARMUP", "1") == "1"  # prime connections and reference data before reporting ready
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 20))  # seconds after which /ready passes regardless
+WARMUP_CONNECTIONS = 2  # keep-alive connections opened to Graph up front
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))  # keep-alive connections per host
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", 8))  # hosts with a live pool
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 2))  # extra attempts for idempotent calls only
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.3))  # seconds, doubled per attempt and jittered
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" lines, or "text" for the classic format when reading a terminal
+LOG_QUEUE_MAX = 10000  # records waiting for the writer thread; beyond this they are dropped (and counted)
+LOG_HASH_PHONES = os.getenv("LOG_HASH_PHONES", "1") == "1"  # phone numbers are logged as a keyed hash
+LOG_HASH_SALT = os.getenv("LOG_HASH_SALT", "")  # set it, or the hashes of a 10^10 number space can be brute-forced
+# share of high-volume events that are logged; each line carries its rate so counts can be re-weighted
+LOG_SAMPLE = {
+    "inbound": float(os.getenv("LOG_SAMPLE_INBOUND", 1.0)),
+    "sent": float(os.getenv("LOG_SAMPLE_SENT", 0.1)),
+    "duplicate": float(os.getenv("LOG_SAMPLE_DUPLICATE", 0.1)),
+}
+
+# ==================== LOGGING ====================
+@lru_cache(maxsize=4096)
+def hash_phone(phone):
+    return "p:" + hashlib.blake2b(str(phone).encode(), key=LOG_HASH_SALT.encode()[:64], digest_size=6).hexdigest()
+
+PHONE_FIELDS = {"to", "frm", "phone"}
+PHONE_RE = re.compile(r"(?<!\d)\d{11,15}(?!\d)")  # international numbers as WhatsApp sends them (919876543210)
+
+def _redact(text):
+    return PHONE_RE.sub(lambda m: hash_phone(m.group()), text) if LOG_HASH_PHONES else text
+
+def _event_fields(record):
+    return {k: hash_phone(v) if LOG_HASH_PHONES and k in PHONE_FIELDS and v else v for k, v in record.fields.items()}
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line; structured events keep their fields, plain messages are redacted text"""
+
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name}
+        if hasattr(record, "event"):
+            entry["event"] = record.event
+            entry.update(_event_fields(record))
+            if record.sample_rate < 1:
+                entry["sample_rate"] = record.sample_rate
+        else:
+            entry["msg"] = _redact(record.getMessage())
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    """The original `time - LEVEL - message` lines, with the same redaction"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(levelname)s - %(message)s")
+
+    def formatMessage(self, record):
+        if hasattr(record, "event"):
+            record.message = " | ".join([record.event.upper()] + [f"{k} {v}" for k, v in _event_fields(record).items()])
+        else:
+            record.message = _redact(record.message)
+        return super().formatMessage(record)
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the writer thread and drops records when full"""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self.pipeline.put(record)
+
+class _EventQueueListener(QueueListener):
+    """Turns the bare tuples queued by log_event into LogRecords, on the writer thread"""
+
+    def prepare(self, item):
+        if not isinstance(item, tuple):
+            return item
+        created, level, name, fields, rate = item
+        record = logger.makeRecord(logger.name, level, "(event)", 0, name, None, None,
+                                   extra={"event": name, "fields": fields, "sample_rate": rate})
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        return record
+
+class LogPipeline:
+    """Request threads only enqueue log records; one background thread formats and writes them.
+
+    Every logger (ours, waitress, werkzeug) goes through the root handler. Structured events
+    (log_event) are sampled per LOG_SAMPLE before anything is built, and the ones kept are
+    queued as a bare tuple: the LogRecord, caller lookup and formatting all happen on the
+    writer thread. Past queue_max waiting records new ones are dropped, never blocked on.
+    """
+
+    def __init__(self, fmt, queue_max, sample, stream=None):
+        self.sample = sample
+        self.queue_max = queue_max
+        self.queue = queue.SimpleQueue()
+        self.counts = {"sampled_out": 0, "dropped": 0}
+        self.lock = Lock()
+        stream = logging.StreamHandler(stream or sys.stdout)
+        stream.setFormatter(JsonLogFormatter() if fmt == "json" else TextLogFormatter())
+        self.listener = _EventQueueListener(self.queue, stream, respect_handler_level=True)
+        self.running = False
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+    def put(self, item):
+        if self.queue_max and self.queue.qsize() >= self.queue_max:
+            self.count("dropped")
+        else:
+            self.queue.put(item)
+
+    def start(self):
+        root = logging.getLogger()
+        root.handlers = [_DeferredQueueHandler(self)]
+        root.setLevel(logging.INFO)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.listener.stop()  # writes out whatever is still queued
+
+    def event(self, name, level, fields):
+        rate = self.sample.get(name, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self.count("sampled_out")
+        elif logger.isEnabledFor(level):
+            self.put((time.time(), level, name, fields, rate))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, queued=self.queue.qsize())
+
+log_pipeline = LogPipeline(LOG_FORMAT, LOG_QUEUE_MAX, LOG_SAMPLE)
+log_pipeline.start()
+logger.info("GAJA BOT STARTING - MERGED BUILD")
+
+def log_event(event, level=logging.INFO, **fields):
+    """Structured log line, e.g. log_event("sent", to=phone, type="text"); phone fields are hashed"""
+    log_pipeline.event(event, level, fields)
 
 # ==================== WARRANTY TERMS (ENGLISH ONLY) ====================
 WARRANTY_TC = """📋 *WARRANTY TERMS & CONDITIONS*
@@ -47,54 +289,864 @@ WARRANTY_TC = """📋 *WARRANTY TERMS & CONDITIONS*
 📞 *For Claims:* {phone}"""
 
 # ==================== STORAGE ====================
-sessions = {}
-messages_seen = {}
-lock = Lock()
+class Session:
+    """One user's conversation state.
+
+    Fixed __slots__ instead of a free-form dict keeps every record small; item access is
+    kept so the flow handlers can keep using session["state"], session.get(...) etc.
+    """
+
+    __slots__ = ("lang", "state", "warranty_token", "warranty_product", "carpenter_code", "months", "expires", "size")
+
+    def __init__(self, lang=None, state="start", **fields):
+        self.lang = lang
+        self.state = state
+        self.warranty_token = self.warranty_product = self.carpenter_code = self.months = None
+        self.expires = 0
+        self.size = 0  # nbytes() as of the last save, kept by SessionStore
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        setattr(self, key, None)
+        return value
+
+    def nbytes(self):
+        """Approximate memory held by this record and its values"""
+        size = sys.getsizeof(self)
+        for key in ("lang", "state", "warranty_token", "carpenter_code"):
+            size += sys.getsizeof(getattr(self, key))
+        if self.months:
+            size += sys.getsizeof(self.months) + sum(sys.getsizeof(m) for m in self.months)
+        if self.warranty_product:
+            size += len(json.dumps(self.warranty_product).encode())
+        return size
+
+class SessionStore:
+    """Sessions keyed by phone number, bounded in both time and count.
+
+    Expiry times sit in a min-heap that a background sweep pops from, so stale sessions
+    are actually freed rather than just ignored; the LRU order of the OrderedDict decides
+    who goes when the SESSION_MAX cap is hit. The memory total is kept up to date on every
+    save and removal, so stats() costs the same however many sessions are live.
+    """
+
+    def __init__(self, timeout, max_size):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.records = OrderedDict()  # phone -> Session, least recently used first
+        self.expiry_heap = []  # (expires, phone); entries are stale once the session is re-saved
+        self.lock = Lock()
+        self.counts = {"expired": 0, "evicted": 0, "ended": 0}
+        self.bytes = 0
+
+    def get(self, phone):
+        with self.lock:
+            record = self.records.get(phone)
+            if record and record.expires > time.time():
+                self.records.move_to_end(phone)
+                return record
+        # fresh default
+        return Session()
+
+    def save(self, phone, data):
+        record = data if isinstance(data, Session) else Session(**data)
+        record.expires = time.time() + self.timeout
+        size = record.nbytes()
+        with self.lock:
+            previous = self.records.get(phone)
+            if previous is not None:
+                self.bytes -= previous.size
+            record.size = size
+            self.bytes += size
+            self.records[phone] = record
+            self.records.move_to_end(phone)
+            heapq.heappush(self.expiry_heap, (record.expires, phone))
+            while len(self.records) > self.max_size:
+                self.bytes -= self.records.popitem(last=False)[1].size
+                self.counts["evicted"] += 1
+            # re-saves leave stale heap entries behind; rebuild before they dominate
+            if len(self.expiry_heap) > 2 * len(self.records) + 64:
+                self.expiry_heap = [(r.expires, p) for p, r in self.records.items()]
+                heapq.heapify(self.expiry_heap)
+
+    def delete(self, phone):
+        with self.lock:
+            record = self.records.pop(phone, None)
+            if record is not None:
+                self.bytes -= record.size
+                self.counts["ended"] += 1
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                expires, phone = heapq.heappop(self.expiry_heap)
+                record = self.records.get(phone)
+                if record is not None and record.expires == expires:
+                    del self.records[phone]
+                    self.bytes -= record.size
+                    self.counts["expired"] += 1
+
+    def _sweeper(self):
+        while True:
+            time.sleep(SESSION_SWEEP_INTERVAL)
+            self.sweep()
+
+    def start(self):
+        Thread(target=self._sweeper, name="session-sweeper", daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, live=len(self.records), max_size=self.max_size,
+                        heap_size=len(self.expiry_heap), bytes=self.bytes)
+
+session_store = SessionStore(SESSION_TIMEOUT, SESSION_MAX)
+session_store.start()
 
 def save_session(phone, data):
-    with lock:
-        sessions[phone] = {"data": data, "expires": time.time() + SESSION_TIMEOUT}
+    session_store.save(phone, data)
 
 def get_session(phone):
-    with lock:
-        if phone in sessions and sessions[phone]["expires"] > time.time():
-            return sessions[phone]["data"]
-        # fresh default
-        return {"lang": None, "state": "start"}
+    return session_store.get(phone)
+
+def end_session(phone):
+    session_store.delete(phone)
+
+class DedupStore:
+    """Recently seen message IDs, oldest first.
+
+    Because IDs are kept in insertion order, expiry only ever pops stale entries off the
+    head and the size cap evicts from the same end, so insert and lookup stay O(1)
+    amortized no matter how many IDs arrived in the last DEDUP_TTL seconds.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.seen = OrderedDict()  # msg_id -> first seen
+        self.lock = Lock()
+        self.counts = {"checked": 0, "duplicates": 0, "expired": 0, "evicted": 0}
+
+    def check_and_add(self, msg_id, now=None):
+        """Return True if msg_id was already seen, otherwise remember it"""
+        now = now or time.time()
+        with self.lock:
+            self.counts["checked"] += 1
+            cutoff = now - self.ttl
+            while self.seen:
+                if next(iter(self.seen.values())) >= cutoff:
+                    break
+                self.seen.popitem(last=False)
+                self.counts["expired"] += 1
+            if msg_id in self.seen:
+                self.counts["duplicates"] += 1
+                return True
+            self.seen[msg_id] = now
+            if len(self.seen) > self.max_size:
+                self.seen.popitem(last=False)
+                self.counts["evicted"] += 1
+            return False
+
+    def forget(self, msg_id):
+        """Drop an ID whose message was not taken after all, so its redelivery is accepted"""
+        with self.lock:
+            self.seen.pop(msg_id, None)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, size=len(self.seen), max_size=self.max_size)
+
+dedup = DedupStore(DEDUP_TTL, DEDUP_MAX)
 
 def already_seen(msg_id):
     if not msg_id:
         return False
-    with lock:
+    if dedup.check_and_add(msg_id):
+        log_event("duplicate", id=msg_id)
+        return True
+    return False
+
+# ==================== JOB QUEUE ====================
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 if empty)"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+class JobQueue:
+    """Journaled work queue drained by a pool of worker threads.
+
+    Every job is written to SQLite before the webhook is acked and deleted only once a
+    worker has finished it, so turns that were in flight when the process died are
+    replayed on the next start. Jobs sharing a key (the sender) run one at a time in
+    timestamp order; different keys run concurrently, round-robin.
+
+    The journal covers running the turn, not delivering its replies. A job is done once
+    its handler returns, while the replies it queued are still in OutboundScheduler's
+    memory, so a crash after that loses them (at most once). A replayed turn runs again
+    from the start and repeats any reply that had already gone out. A SIGTERM shutdown
+    avoids both by draining the outbound queues within SHUTDOWN_GRACE.
+    """
+
+    def __init__(self, path, handler, workers):
+        self.handler = handler
+        self.workers = workers
+        self.cond = Condition()
+        self.queues = {}  # key -> deque of (job_id, payload, enqueued_at, ts), oldest ts first
+        self.ready = deque()  # keys with queued jobs that no worker holds
+        self.scheduled = set()  # keys either in `ready` or held by a worker
+        self.db_lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+            "enqueued_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, job_key TEXT, ts REAL)"
+        )
+        self.in_flight = 0
+        self.counts = {"enqueued": 0, "completed": 0, "failed": 0, "replayed": 0, "dropped": 0}
+        self.wait_ms = deque(maxlen=1000)
+        self.latency_ms = deque(maxlen=1000)
+        self.threads = []
+        self._replay()
+
+    def _replay(self):
+        rows = self.db.execute("SELECT id, payload, enqueued_at, attempts, job_key, ts FROM jobs ORDER BY id").fetchall()
+        for job_id, payload, enqueued_at, attempts, key, ts in rows:
+            if attempts >= JOB_MAX_ATTEMPTS:
+                logger.error(f"JOB DROPPED after {attempts} attempts: {job_id}")
+                self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                self.counts["dropped"] += 1
+                continue
+            self._push(key or f"job-{job_id}", (job_id, payload, enqueued_at, ts or enqueued_at))
+            self.counts["replayed"] += 1
+        if self.ready:
+            logger.info(f"JOB QUEUE: replaying {self.counts['replayed']} unfinished jobs")
+
+    def start(self):
+        for i in range(self.workers):
+            t = Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def _push(self, key, job):
+        queue = self.queues.setdefault(key, deque())
+        # keep the sender's jobs in timestamp order; new jobs almost always belong at the tail
+        pos = len(queue)
+        while pos > 0 and queue[pos - 1][3] > job[3]:
+            pos -= 1
+        queue.insert(pos, job)
+        if key not in self.scheduled:
+            self.scheduled.add(key)
+            self.ready.append(key)
+
+    def enqueue(self, payload, key=None, ts=None):
         now = time.time()
-        global messages_seen
-        # cleanup entries older than 10 minutes
-        messages_seen = {k: v for k, v in messages_seen.items() if now - v < 600}
-        if msg_id in messages_seen:
-            logger.info(f"DUPLICATE IGNORED: {msg_id}")
-            return True
-        messages_seen[msg_id] = now
-        return False
+        ts = ts or now
+        if self.workers <= 0:
+            self._run(None, payload, now)
+            return
+        with self.db_lock:
+            cur = self.db.execute("INSERT INTO jobs (payload, enqueued_at, job_key, ts) VALUES (?, ?, ?, ?)",
+                                  (payload, now, key, ts))
+        with self.cond:
+            self._push(key or f"job-{cur.lastrowid}", (cur.lastrowid, payload, now, ts))
+            self.counts["enqueued"] += 1
+            self.cond.notify()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.ready:
+                    self.cond.wait()
+                key = self.ready.popleft()
+                job_id, payload, enqueued_at, _ = self.queues[key].popleft()
+                self.in_flight += 1
+            with self.db_lock:
+                self.db.execute("UPDATE jobs SET attempts = attempts + 1 WHERE id = ?", (job_id,))
+            try:
+                self._run(job_id, payload, enqueued_at)
+            finally:
+                with self.db_lock:
+                    self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                with self.cond:
+                    self.in_flight -= 1
+                    if self.queues[key]:
+                        self.ready.append(key)
+                        self.cond.notify()
+                    else:
+                        del self.queues[key]
+                        self.scheduled.discard(key)
+                        self.cond.notify_all()
+
+    def drain(self, timeout=30):
+        """Wait until every queued job has been handled; True if drained in time"""
+        deadline = time.time() + timeout
+        with self.cond:
+            while (self.scheduled or self.in_flight) and time.time() < deadline:
+                self.cond.wait(0.1)
+            return not self.scheduled and not self.in_flight
+
+    def _run(self, job_id, payload, enqueued_at):
+        started = time.time()
+        outcome = "completed"
+        try:
+            self.handler(json.loads(payload))
+        except Exception as e:
+            outcome = "failed"
+            logger.exception(f"JOB FAILED: {job_id} | {e}")
+        with self.cond:
+            self.counts[outcome] += 1
+            self.wait_ms.append((started - enqueued_at) * 1000)
+            self.latency_ms.append((time.time() - started) * 1000)
+
+    def stats(self):
+        with self.cond:
+            waits, lats = list(self.wait_ms), list(self.latency_ms)
+            return dict(
+                self.counts,
+                depth=sum(len(q) for q in self.queues.values()),
+                keys=len(self.queues),
+                in_flight=self.in_flight,
+                workers=self.workers,
+                wait_ms_p50=round(percentile(waits, 50), 2),
+                wait_ms_p95=round(percentile(waits, 95), 2),
+                wait_ms_max=round(max(waits, default=0), 2),
+                latency_ms_p50=round(percentile(lats, 50), 2),
+                latency_ms_p95=round(percentile(lats, 95), 2),
+                latency_ms_max=round(max(lats, default=0), 2),
+            )
+
+# ==================== METRICS ====================
+class Histogram:
+    """Fixed-bucket histogram; cheap enough to observe on every request"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.n = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += value
+            self.n += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None when empty or past the last bucket)"""
+        with self.lock:
+            counts, n = list(self.counts), self.n
+        if not n:
+            return None
+        rank, seen = q * n, 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
 
-# ==================== SEND HELPERS ====================
-def send(payload):
+    def snapshot(self):
+        with self.lock:
+            return {"count": self.n, "sum": round(self.total, 3),
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))}
+
+    def summary(self):
+        return {"count": self.n, "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+class Family:
+    """One Prometheus metric family: a Histogram, counter or gauge per tuple of label values"""
+
+    def __init__(self, name, help_text, labels=(), buckets=None, kind=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = buckets
+        self.kind = kind or ("counter" if buckets is None else "histogram")
+        self.children = {}
+        self.lock = Lock()
+
+    def child(self, *values):
+        hist = self.children.get(values)
+        if hist is None:
+            with self.lock:
+                hist = self.children.setdefault(values, Histogram(self.buckets))
+        return hist
+
+    def observe(self, value, *values):
+        self.child(*values).observe(value)
+
+    def inc(self, *values, n=1):
+        with self.lock:
+            self.children[values] = self.children.get(values, 0) + n
+
+    def set(self, value, *values):
+        with self.lock:
+            self.children[values] = value
+
+    def _label_str(self, values, extra=""):
+        pairs = ['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self, out):
+        out.append(f"# HELP {self.name} {self.help_text}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        with self.lock:
+            children = sorted(self.children.items(), key=lambda kv: [str(v) for v in kv[0]])
+        for values, child in children:
+            if self.buckets is None:
+                out.append(f"{self.name}{self._label_str(values)} {child}")
+                continue
+            with child.lock:
+                counts, total, n = list(child.counts), child.total, child.n
+            cumulative = 0
+            for bound, count in zip(list(child.buckets) + ["+Inf"], counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                out.append(f"{self.name}_bucket{self._label_str(values, le)} {cumulative}")
+            out.append(f"{self.name}_sum{self._label_str(values)} {total:.6f}")
+            out.append(f"{self.name}_count{self._label_str(values)} {n}")
+
+class Metrics:
+    """Registry behind /metrics.
+
+    Hot-path instrumentation is a perf_counter pair plus one bisect and a short lock
+    per observation; everything else (component gauges) is only computed at scrape time.
+    """
+
+    def __init__(self):
+        self.families = []
+        self.lock = Lock()
+        self.in_flight = 0
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        family = Family(name, help_text, labels, buckets)
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help_text, labels=()):
+        family = Family(name, help_text, labels)
+        self.families.append(family)
+        return family
+
+    def gauge(self, name, help_text, labels=()):
+        family = Family(name, help_text, labels, kind="gauge")
+        self.families.append(family)
+        return family
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def render(self, gauges):
+        """Prometheus text exposition; `gauges` maps component -> its stats() dict"""
+        out = ["# HELP gaja_http_requests_in_flight Flask requests currently being handled",
+               "# TYPE gaja_http_requests_in_flight gauge",
+               f"gaja_http_requests_in_flight {self.in_flight}"]
+        for family in self.families:
+            family.render(out)
+        # Top-level numbers of each component's stats() become gauges, e.g. gaja_sessions_live
+        for component, values in gauges.items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    out.append(f"# TYPE gaja_{component}_{key} gauge")
+                    out.append(f"gaja_{component}_{key} {value}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+webhook_seconds = metrics.histogram("gaja_webhook_seconds", "Time to handle one POST /webhook delivery")
+api_seconds = metrics.histogram("gaja_api_call_seconds", "Apps Script api_call latency", ("action",))
+api_errors = metrics.counter("gaja_api_call_errors_total", "Apps Script api_call failures", ("action",))
+lookup_seconds = metrics.histogram("gaja_lookup_seconds", "Latency of cached lookups, replica and cache hits included", ("lookup",))
+lookup_errors = metrics.counter("gaja_lookup_errors_total", "Lookups that returned no answer because upstream failed", ("lookup",))
+api_hedges = metrics.counter("gaja_api_hedges_total", "Hedged second requests fired, by whether the hedge answered first", ("action", "won"))
+api_short_circuits = metrics.counter("gaja_api_short_circuits_total", "api_call attempts refused by an open circuit breaker", ("action",))
+api_stale = metrics.counter("gaja_api_stale_served_total", "Expired cache entries served because Apps Script failed", ("action",))
+api_circuit_state = metrics.gauge("gaja_api_circuit_state", "Apps Script circuit breaker per action: 0 closed, 1 half-open, 2 open", ("action",))
+admission_shed = metrics.counter("gaja_admission_shed_total", "Inbound messages dropped by admission control", ("reason",))
+webhook_payloads = metrics.counter("gaja_webhook_payloads_total", "POST /webhook bodies by pre-classified payload class", ("class",))
+graph_send_seconds = metrics.histogram("gaja_graph_send_seconds", "Graph messages POST latency", ("type", "status"))
+
+# ==================== HTTP CLIENT ====================
+class _CountingHTTPConnection(urllib3.connection.HTTPConnection):
+    def connect(self):
+        http_client.count(self.host, "handshakes")
+        super().connect()
+
+class _CountingHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        http_client.count(self.host, "handshakes")
+        super().connect()
+
+class _CountingHTTPPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+class _CountingHTTPSPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools count every new TCP/TLS connection they open"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _CountingHTTPPool, "https": _CountingHTTPSPool}
+
+    def send(self, request, **kwargs):
+        http_client.count(urlparse(request.url).hostname, "requests")
+        return super().send(request, **kwargs)
+
+class HttpClient:
+    """Shared keep-alive client for Graph, Apps Script and Pumble.
+
+    One requests.Session with a connection pool per host, so repeat calls reuse an open
+    connection instead of paying a fresh TCP+TLS handshake. A call is sent once unless the
+    caller passes retry=True (only for requests known to be safe to repeat, whatever their
+    method: Apps Script writes are GETs), then retried with jittered exponential backoff.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size, pool_hosts, retries, backoff):
+        self.retries = retries
+        self.backoff = backoff
+        self.counts = {}
+        self.counts_lock = Lock()
+        self.session = requests.Session()
+        adapter = _PooledAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def count(self, host, key, n=1):
+        with self.counts_lock:
+            per_host = self.counts.setdefault(host, {"requests": 0, "handshakes": 0, "retries": 0, "errors": 0})
+            per_host[key] += n
+
+    def request(self, method, url, retry=False, **kwargs):
+        attempts = 1 + (self.retries if retry else 0)
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                r = self.session.request(method, url, **kwargs)
+                if last or r.status_code not in self.RETRY_STATUSES:
+                    return r
+                r.close()  # hand the connection back to the pool before retrying
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    self.count(urlparse(url).hostname, "errors")
+                    raise
+            self.count(urlparse(url).hostname, "retries")
+            time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self.counts_lock:
+            return {host: dict(c, reused=max(0, c["requests"] - c["handshakes"])) for host, c in self.counts.items()}
+
+http_client = HttpClient(HTTP_POOL_SIZE, HTTP_POOL_HOSTS, HTTP_RETRIES, HTTP_BACKOFF)
+
+# ==================== OUTBOUND SCHEDULER ====================
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = Lock()
+
+    def try_acquire(self, reserve=0):
+        """Take a token, leaving at least `reserve` behind; returns 0 on success or the seconds to wait"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1 + reserve:
+                self.tokens -= 1
+                return 0
+            return (1 + reserve - self.tokens) / self.rate
+
+    def acquire(self, reserve=0):
+        while True:
+            wait = self.try_acquire(reserve)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hand out nothing for `seconds` (e.g. after the upstream said we are over its limit)"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+def deliver(payload):
+    """POST one message to Graph; returns (status_code, response body)"""
     url = f"{GRAPH}/{PHONE_ID}/messages"
+    started = time.perf_counter()
+    status = None
     try:
-        r = requests.post(url, headers=HEADERS, json=payload, timeout=15)
+        if isinstance(payload, PreparedMessage):
+            r = http_client.post(url, headers=HEADERS, data=payload.body, timeout=15)
+        else:
+            r = http_client.post(url, headers=HEADERS, json=payload, timeout=15)
+        status = r.status_code
         if r.status_code == 200:
-            logger.info(f"SENT to {payload.get('to')} | {payload.get('type','text')}")
+            log_event("sent", to=payload.get("to"), type=payload.get("type", "text"))
         else:
             logger.error(f"SEND FAILED {r.status_code} → {r.text[:500]}")
-        return r.json()
+        return r.status_code, r.json()
     except Exception as e:
         logger.error(f"SEND EXCEPTION: {e}")
-        return {"error": str(e)}
+        return None, {"error": str(e)}
+    finally:
+        graph_send_seconds.observe(time.perf_counter() - started, payload.get("type", "text"), status or "error")
+
+def is_throttled(status, body):
+    code = (body.get("error") or {}).get("code") if isinstance(body, dict) and isinstance(body.get("error"), dict) else None
+    return status == 429 or code in GRAPH_THROTTLE_CODES
+
+class OutboundScheduler:
+    """Per-recipient FIFO queues for Graph sends, pipelined across recipients.
+
+    A recipient is handed to at most one worker at a time and the worker sends a single
+    message before putting the recipient back in line, so each user's messages keep their
+    order while different users are served concurrently (round-robin). Every send takes a
+    token from the PHONE_NUMBER_ID bucket, and throttle responses are retried with backoff
+    (pausing the whole bucket) instead of being dropped. The queues are not journaled:
+    what is still queued when the process dies is lost (see JobQueue).
+    """
+
+    def __init__(self, workers, bucket):
+        self.workers = workers
+        self.bucket = bucket
+        self.queues = {}  # recipient -> deque of (queued_at, payload, turn received_at)
+        self.ready = deque()  # recipients with queued messages that no worker holds
+        self.scheduled = set()  # recipients either in `ready` or held by a worker
+        self.cond = Condition()
+        self.in_flight = 0
+        self.counts = {"queued": 0, "sent": 0, "failed": 0, "throttled": 0, "gave_up": 0}
+        self.wait_ms = deque(maxlen=1000)
+
+    def submit(self, payload, received_at=None):
+        to = payload.get("to")
+        with self.cond:
+            self.queues.setdefault(to, deque()).append((time.time(), payload, received_at))
+            self.counts["queued"] += 1
+            if to not in self.scheduled:
+                self.scheduled.add(to)
+                self.ready.append(to)
+                self.cond.notify()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.ready:
+                    self.cond.wait()
+                to = self.ready.popleft()
+                queued_at, payload, received_at = self.queues[to].popleft()
+                self.in_flight += 1
+                self.wait_ms.append((time.time() - queued_at) * 1000)
+            try:
+                self.send_now(payload, received_at)
+            finally:
+                with self.cond:
+                    self.in_flight -= 1
+                    if self.queues[to]:
+                        self.ready.append(to)
+                        self.cond.notify()
+                    else:
+                        del self.queues[to]
+                        self.scheduled.discard(to)
+                        self.cond.notify_all()
+
+    def send_now(self, payload, received_at=None):
+        """Rate-limited delivery with throttle backoff; returns the Graph response body"""
+        for attempt in range(GRAPH_MAX_RETRIES + 1):
+            self.bucket.acquire()
+            status, body = deliver(payload)
+            if status != 200 and media.is_media_error(body):
+                repaired = media.repair(payload)
+                if repaired is not None:
+                    payload = repaired
+                    status, body = deliver(payload)
+            if not is_throttled(status, body):
+                with self.cond:
+                    self.counts["sent" if status == 200 else "failed"] += 1
+                if status == 200:
+                    deliveries.on_sent(body, payload.get("type"), received_at)
+                else:
+                    deliveries.on_send_failed(payload.get("type"))
+                return body
+            with self.cond:
+                self.counts["throttled"] += 1
+            backoff = min(60, 2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.warning(f"GRAPH THROTTLED ({status}), backing off {backoff:.1f}s for {payload.get('to')}")
+            self.bucket.pause(backoff)
+        with self.cond:
+            self.counts["gave_up"] += 1
+        logger.error(f"SEND GAVE UP after {GRAPH_MAX_RETRIES} throttled retries: {payload.get('to')}")
+        return body
+
+    def start(self):
+        for i in range(self.workers):
+            Thread(target=self._worker, name=f"outbound-{i}", daemon=True).start()
+
+    def drain(self, timeout=30):
+        """Wait until every queued message has been sent; True if drained in time"""
+        deadline = time.time() + timeout
+        with self.cond:
+            while (self.scheduled or self.in_flight) and time.time() < deadline:
+                self.cond.wait(0.1)
+            return not self.scheduled and not self.in_flight
+
+    def stats(self):
+        with self.cond:
+            waits = list(self.wait_ms)
+            return dict(self.counts, depth=sum(len(q) for q in self.queues.values()),
+                        recipients=len(self.queues), in_flight=self.in_flight, workers=self.workers,
+                        wait_ms_p50=round(percentile(waits, 50), 2), wait_ms_p95=round(percentile(waits, 95), 2))
+
+outbound = OutboundScheduler(OUTBOUND_WORKERS, TokenBucket(GRAPH_RATE, GRAPH_BURST))
+outbound.start()
+
+# ==================== DELIVERY TRACKING ====================
+turn = local()  # per-thread context of the inbound turn being handled (received_at)
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60, 120, 300, 900)  # seconds
+
+class DeliveryTracker:
+    """Correlates Graph status callbacks with the message IDs send() got back.
+
+    Each sent wamid is remembered (oldest first, bounded by STATUS_TRACK_MAX and
+    STATUS_TRACK_TTL) with its send time, type and the time the inbound message that
+    triggered it arrived. The first "delivered" status feeds the send->delivered and
+    inbound->reply-delivered histograms; "failed" statuses count per message type.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.pending = OrderedDict()  # wamid -> [sent_at, mtype, received_at, delivered]
+        self.lock = Lock()
+        self.send_to_delivered = Histogram(LATENCY_BUCKETS)
+        self.inbound_to_delivered = Histogram(LATENCY_BUCKETS)
+        self.by_type = {}
+        self.counts = {"statuses": 0, "unmatched": 0, "expired": 0, "evicted": 0}
+
+    def _count(self, mtype, key):
+        per_type = self.by_type.setdefault(mtype or "unknown", {"sent": 0, "send_errors": 0, "delivered": 0, "read": 0, "failed": 0})
+        per_type[key] += 1
+
+    def on_sent(self, body, mtype, received_at=None):
+        try:
+            wamid = body["messages"][0]["id"]
+        except (KeyError, IndexError, TypeError):
+            return
+        now = time.time()
+        with self.lock:
+            self._count(mtype, "sent")
+            self.pending[wamid] = [now, mtype, received_at, False]
+            cutoff = now - self.ttl
+            while self.pending and next(iter(self.pending.values()))[0] < cutoff:
+                self.pending.popitem(last=False)
+                self.counts["expired"] += 1
+            while len(self.pending) > self.max_size:
+                self.pending.popitem(last=False)
+                self.counts["evicted"] += 1
+
+    def on_send_failed(self, mtype):
+        with self.lock:
+            self._count(mtype, "send_errors")
+
+    def on_status(self, status):
+        state = status.get("status")
+        now = time.time()
+        with self.lock:
+            self.counts["statuses"] += 1
+            record = self.pending.get(status.get("id"))
+            if record is None:
+                self.counts["unmatched"] += 1
+                return
+            sent_at, mtype, received_at, delivered = record
+            if state == "delivered" and not delivered:
+                record[3] = True
+                self._count(mtype, "delivered")
+            elif state == "read":
+                self._count(mtype, "read")
+                self.pending.pop(status.get("id"), None)  # read is the last status we wait for
+            elif state == "failed":
+                self._count(mtype, "failed")
+                self.pending.pop(status.get("id"), None)
+                errors = status.get("errors") or [{}]
+                logger.warning(f"DELIVERY FAILED: {status.get('recipient_id')} | {mtype} | {errors[0].get('code')} {errors[0].get('title', '')}")
+                return
+            else:
+                return
+        if state == "delivered" and not delivered:
+            self.send_to_delivered.observe(now - sent_at)
+            if received_at:
+                self.inbound_to_delivered.observe(now - received_at)
+
+    def stats(self):
+        with self.lock:
+            by_type = {}
+            for mtype, c in self.by_type.items():
+                attempted = c["sent"] + c["send_errors"]
+                by_type[mtype] = dict(c, failure_rate=round((c["failed"] + c["send_errors"]) / attempted, 4) if attempted else 0)
+            result = dict(self.counts, tracked=len(self.pending), max_size=self.max_size, by_type=by_type)
+        result["send_to_delivered_s"] = self.send_to_delivered.summary()
+        result["inbound_to_delivered_s"] = self.inbound_to_delivered.summary()
+        return result
+
+deliveries = DeliveryTracker(STATUS_TRACK_MAX, STATUS_TRACK_TTL)
 
-def send_text(to, body):
-    send({"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}})
+# ==================== SEND HELPERS ====================
+def send(payload):
+    """Queue a message for its recipient (sent inline when OUTBOUND_WORKERS is 0)"""
+    received_at = getattr(turn, "received_at", None)
+    if outbound.workers <= 0:
+        return outbound.send_now(payload, received_at)
+    outbound.submit(payload, received_at)
 
-def send_buttons(to, body, buttons):
-    send({
+def text_payload(to, body):
+    return {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}}
+
+def buttons_payload(to, body, buttons):
+    return {
         "messaging_product": "whatsapp",
         "to": to,
         "type": "interactive",
@@ -103,7 +1155,13 @@ def send_buttons(to, body, buttons):
             "body": {"text": body},
             "action": {"buttons": [{"type": "reply", "reply": {"id": b["id"], "title": b["title"]}} for b in buttons[:3]]}
         }
-    })
+    }
+
+def send_text(to, body):
+    send(text_payload(to, body))
+
+def send_buttons(to, body, buttons):
+    send(buttons_payload(to, body, buttons))
 
 def send_list(to, body, button_text, rows):
     send({
@@ -117,61 +1175,899 @@ def send_list(to, body, button_text, rows):
         }
     })
 
-def send_document(to, url, caption=None, filename=None):
-    doc = {"link": url}
+def document_payload(to, url, caption=None, filename=None, wait=False):
+    media_id = media.media_id(url, filename, wait=wait)
+    doc = {"id": media_id} if media_id else {"link": url}
     if filename:
         doc["filename"] = filename
     payload = {"messaging_product": "whatsapp", "to": to, "type": "document", "document": doc}
     if caption:
         payload["document"]["caption"] = caption
-    send(payload)
+    return payload
 
-def send_image(to, url, caption=None):
-    payload = {"messaging_product": "whatsapp", "to": to, "type": "image", "image": {"link": url}}
+def image_payload(to, url, caption=None, wait=False):
+    media_id = media.media_id(url, wait=wait)
+    payload = {"messaging_product": "whatsapp", "to": to, "type": "image", "image": {"id": media_id} if media_id else {"link": url}}
     if caption:
         payload["image"]["caption"] = caption
-    send(payload)
+    return payload
+
+def send_document(to, url, caption=None, filename=None):
+    send(document_payload(to, url, caption, filename))
+
+def send_image(to, url, caption=None):
+    send(image_payload(to, url, caption))
+
+# ==================== MEDIA (upload once, send by ID) ====================
+class MediaManager:
+    """Uploads our hosted media (catalogue PDF, scheme images) to Graph once and sends by ID.
+
+    Media IDs are cached with their expiry in SQLite so a restart does not re-upload.
+    A conversation never waits for an upload: an asset without an ID is sent by link,
+    exactly as before, while it is uploaded in the background. Campaign workers pass
+    wait=True and upload first. An ID close to expiry is refreshed by a background
+    thread, and one that Graph rejects is dropped and re-uploaded by repair(). A URL whose
+    upload failed is not tried again for MEDIA_FAILURE_BACKOFF (doubling per consecutive
+    failure), so sends during an upload outage do not each download the asset again.
+    """
+
+    def __init__(self, path):
+        self.entries = {}  # url -> (media_id, expires)
+        self.upload_locks = {}
+        self.uploading = set()  # urls with a background upload running
+        self.failures = {}  # url -> (retry_at, consecutive failures)
+        self.lock = Lock()
+        self.counts = {"uploads": 0, "upload_failures": 0, "link_fallbacks": 0, "hits": 0, "repairs": 0, "refreshes": 0}
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("CREATE TABLE IF NOT EXISTS media (url TEXT PRIMARY KEY, media_id TEXT NOT NULL, expires REAL NOT NULL)")
+        for url, media_id, expires in self.db.execute("SELECT url, media_id, expires FROM media"):
+            self.entries[url] = (media_id, expires)
+
+    def media_id(self, url, filename=None, wait=False):
+        """Cached (or, with wait, freshly uploaded) media ID for url; None means send by link"""
+        if not ACCESS_TOKEN or not PHONE_ID:
+            return None
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry and entry[1] > time.time():
+                self.counts["hits"] += 1
+                return entry[0]
+        if wait:
+            return self.upload(url, filename)
+        self.upload_in_background(url, filename)
+        return None
+
+    def upload_in_background(self, url, filename=None):
+        """Start uploading url unless that is already running or backing off; the caller sends by link"""
+        with self.lock:
+            self.counts["link_fallbacks"] += 1
+            if url in self.uploading or self.failures.get(url, (0, 0))[0] > time.time():
+                return
+            self.uploading.add(url)
+        def run():
+            try:
+                self.upload(url, filename)
+            finally:
+                with self.lock:
+                    self.uploading.discard(url)
+        Thread(target=run, name="media-upload", daemon=True).start()
+
+    def upload(self, url, filename=None, stale_id=None):
+        with self.lock:
+            upload_lock = self.upload_locks.setdefault(url, Lock())
+        with upload_lock:
+            entry = self.entries.get(url)
+            if entry and entry[1] > time.time() and entry[0] != stale_id:
+                return entry[0]  # someone else uploaded while we waited
+            with self.lock:
+                if self.failures.get(url, (0, 0))[0] > time.time():
+                    self.counts["link_fallbacks"] += 1
+                    return None
+            try:
+                src = http_client.get(url, timeout=60, retry=True)
+                src.raise_for_status()
+                mime = (mimetypes.guess_type(filename or urlparse(url).path)[0]
+                        or src.headers.get("Content-Type", "application/octet-stream").split(";")[0])
+                r = http_client.post(
+                    f"{GRAPH}/{PHONE_ID}/media",
+                    headers={"Authorization": f"Bearer {ACCESS_TOKEN}"},
+                    data={"messaging_product": "whatsapp", "type": mime},
+                    files={"file": (filename or os.path.basename(urlparse(url).path) or "file", src.content, mime)},
+                    timeout=60,
+                )
+                r.raise_for_status()
+                media_id = r.json()["id"]
+            except Exception as e:
+                with self.lock:
+                    self.counts["upload_failures"] += 1
+                    failures = self.failures.get(url, (0, 0))[1] + 1
+                    backoff = min(MEDIA_FAILURE_BACKOFF_MAX, MEDIA_FAILURE_BACKOFF * 2 ** (failures - 1))
+                    self.failures[url] = (time.time() + backoff, failures)
+                logger.error(f"MEDIA UPLOAD FAILED: {url} | {e} | sending by link for {backoff:.0f}s")
+                return None
+            expires = time.time() + MEDIA_TTL
+            with self.lock:
+                self.failures.pop(url, None)
+                self.entries[url] = (media_id, expires)
+                self.counts["uploads"] += 1
+                self.db.execute("INSERT OR REPLACE INTO media (url, media_id, expires) VALUES (?, ?, ?)", (url, media_id, expires))
+            logger.info(f"MEDIA UPLOADED: {url} -> {media_id}")
+            return media_id
+
+    @staticmethod
+    def is_media_error(body):
+        error = body.get("error") if isinstance(body, dict) else None
+        return isinstance(error, dict) and error.get("code") in MEDIA_ERROR_CODES
+
+    def repair(self, payload, wait=False):
+        """Re-upload the media a rejected payload refers to; returns the fixed payload or None.
+
+        Without wait the stale ID is dropped and the fixed payload sends by link while the
+        upload runs in the background.
+        """
+        if not isinstance(payload, dict):
+            return None
+        mtype = payload.get("type")
+        stale_id = (payload.get(mtype) or {}).get("id") if mtype in ("image", "document") else None
+        if not stale_id:
+            return None
+        with self.lock:
+            url = next((u for u, (mid, _) in self.entries.items() if mid == stale_id), None)
+        if url is None:
+            return None
+        logger.warning(f"MEDIA REJECTED by Graph, re-uploading: {url}")
+        with self.lock:
+            self.counts["repairs"] += 1
+        fixed = copy.deepcopy(payload)
+        if wait:
+            media_id = self.upload(url, fixed[mtype].get("filename"), stale_id=stale_id)
+        else:
+            with self.lock:
+                if self.entries.get(url, (None,))[0] == stale_id:
+                    del self.entries[url]
+                    self.db.execute("DELETE FROM media WHERE url = ?", (url,))
+            self.upload_in_background(url, fixed[mtype].get("filename"))
+            media_id = None
+        fixed[mtype].pop("id")
+        fixed[mtype]["id" if media_id else "link"] = media_id or url
+        return fixed
+
+    def refresh_expiring(self):
+        with self.lock:
+            due = [url for url, (_, expires) in self.entries.items() if expires - time.time() < MEDIA_REFRESH_MARGIN]
+        for url in due:
+            if self.upload(url, stale_id=self.entries[url][0]):
+                with self.lock:
+                    self.counts["refreshes"] += 1
+
+    def _refresher(self):
+        while True:
+            time.sleep(3600)
+            try:
+                self.refresh_expiring()
+            except Exception as e:
+                logger.error(f"MEDIA REFRESH ERROR: {e}")
+
+    def start(self):
+        Thread(target=self._refresher, name="media-refresher", daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            now = time.time()
+            return dict(self.counts, cached=len(self.entries),
+                        backing_off=sum(1 for retry_at, _ in self.failures.values() if retry_at > now),
+                        min_ttl_hours=round(min((e - now for _, e in self.entries.values()), default=0) / 3600, 1))
+
+media = MediaManager(JOB_DB_PATH)
+media.start()
+
+# ==================== MESSAGE TEMPLATES ====================
+class PreparedMessage:
+    """A message already encoded as the JSON request body; get() mirrors the payload dict"""
+
+    __slots__ = ("to", "type", "body")
+
+    def __init__(self, to, mtype, body):
+        self.to = to
+        self.type = mtype
+        self.body = body
+
+    def get(self, key, default=None):
+        return {"to": self.to, "type": self.type}.get(key, default)
+
+class MessageTemplate:
+    """A payload serialised to JSON once, with {{slot}} markers spliced in per send.
+
+    The encoded body is split around the markers at build time, so rendering is a join of
+    the fixed byte chunks and the JSON-escaped slot values (always including "to"). With
+    `slots` only those names are markers, and any other {{...}} in the payload is literal text.
+    """
+
+    SLOT_RE = re.compile(r"\{\{(\w+)\}\}")
+    NEEDS_ESCAPE_RE = re.compile(r'[\\"\x00-\x1f]')
+
+    def __init__(self, payload, slots=None):
+        encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        slot_re = self.SLOT_RE if slots is None else re.compile(r"\{\{(%s)\}\}" % "|".join(map(re.escape, slots)))
+        parts = slot_re.split(encoded)
+        self.chunks = parts[0::2]
+        self.slots = parts[1::2]
+        self.type = payload.get("type")
+
+    def render(self, **values):
+        chunks = self.chunks
+        out = [chunks[0]]
+        for i, slot in enumerate(self.slots, 1):
+            value = str(values[slot])
+            if self.NEEDS_ESCAPE_RE.search(value):
+                value = json.dumps(value, ensure_ascii=False)[1:-1]
+            out.append(value)
+            out.append(chunks[i])
+        return PreparedMessage(values.get("to"), self.type, "".join(out).encode())
+
+class TemplateRegistry:
+    """Named message templates, one per language variant, built once at startup"""
+
+    def __init__(self):
+        self.templates = {}
+
+    def add(self, name, lang, payload):
+        self.templates[(name, lang)] = MessageTemplate(payload)
+
+    def render(self, template_name, lang, to, **values):
+        template = self.templates.get((template_name, "en" if lang == "en" else "ta")) or self.templates[(template_name, None)]
+        return template.render(to=to, **values)
+
+def send_template(template_name, lang, to, **values):
+    send(templates.render(template_name, lang, to, **values))
+
+# ==================== PUMBLE NOTIFIER ====================
+class PumbleNotifier:
+    """Buffers WARRANTY/CASHBACK events and posts them to Pumble off the request path.
+
+    A background thread flushes once PUMBLE_BATCH_SIZE events are waiting or the oldest
+    has waited PUMBLE_FLUSH_INTERVAL seconds, joining the batch into a single message.
+    Failed posts are retried with backoff; if the buffer fills up new events are dropped.
+    """
+
+    def __init__(self, url, batch_size, interval, max_queue):
+        self.url = url
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self.buffer = deque()  # (queued_at, text)
+        self.cond = Condition()
+        self.flushing = False
+        self.counts = {"queued": 0, "sent": 0, "posts": 0, "retries": 0, "failed": 0, "dropped": 0}
+
+    def notify(self, text):
+        if not self.url:
+            return
+        with self.cond:
+            if len(self.buffer) >= self.max_queue:
+                self.counts["dropped"] += 1
+                return
+            self.buffer.append((time.time(), text))
+            self.counts["queued"] += 1
+            if len(self.buffer) == 1 or len(self.buffer) >= self.batch_size:
+                self.cond.notify()  # a new head starts the flush timer; a full batch goes now
+
+    def _next_batch(self):
+        with self.cond:
+            while True:
+                if self.buffer:
+                    due = self.buffer[0][0] + self.interval
+                    if len(self.buffer) >= self.batch_size or time.time() >= due:
+                        break
+                    self.cond.wait(due - time.time())
+                else:
+                    self.cond.wait()
+            batch = [self.buffer.popleft()[1] for _ in range(min(self.batch_size, len(self.buffer)))]
+            self.flushing = True
+            return batch
+
+    def _post(self, batch):
+        for attempt in range(PUMBLE_RETRIES + 1):
+            try:
+                r = http_client.post(self.url, json={"text": "\n".join(batch)}, timeout=5)
+                r.raise_for_status()
+                self.counts["posts"] += 1
+                self.counts["sent"] += len(batch)
+                return
+            except Exception as e:
+                if attempt == PUMBLE_RETRIES:
+                    self.counts["failed"] += len(batch)
+                    logger.error(f"PUMBLE POST FAILED ({len(batch)} events): {e}")
+                    return
+                self.counts["retries"] += 1
+                time.sleep(2 ** attempt * random.uniform(0.5, 1.5))
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._post(batch)
+            finally:
+                with self.cond:
+                    self.flushing = False
+                    self.cond.notify_all()
+
+    def start(self):
+        if self.url:
+            Thread(target=self._worker, name="pumble-notifier", daemon=True).start()
+
+    def flush(self, timeout=10):
+        """Push out everything buffered now (used on shutdown); True if the buffer drained"""
+        deadline = time.time() + timeout
+        with self.cond:
+            while (self.buffer or self.flushing) and time.time() < deadline:
+                if self.buffer:
+                    self.buffer[0] = (0, self.buffer[0][1])  # make the head due immediately
+                    self.cond.notify_all()
+                self.cond.wait(0.1)
+            return not self.buffer and not self.flushing
+
+    def stats(self):
+        with self.cond:
+            return dict(self.counts, depth=len(self.buffer))
+
+pumble = PumbleNotifier(PUMBLE_WEBHOOK, PUMBLE_BATCH_SIZE, PUMBLE_FLUSH_INTERVAL, PUMBLE_QUEUE_MAX)
+pumble.start()
 
 # ==================== GENERIC APPS-SCRIPT / API HELPERS (Warranty-compatible) ====================
+class CircuitBreaker:
+    """Closed -> open when too many recent calls failed; one probe after a cooldown closes it again"""
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, name, window, min_calls, error_rate, cooldown):
+        self.name = name
+        self.outcomes = deque(maxlen=window)  # True = success
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = 0
+        self.probing = False
+        self.lock = Lock()
+        self.counts = {"opened": 0, "short_circuits": 0}
+
+    def _set(self, state):
+        self.state = state
+        api_circuit_state.set(self.STATES[state], self.name)
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() - self.opened_at >= self.cooldown:
+                self._set("half_open")
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            self.counts["short_circuits"] += 1
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            if self.state == "half_open":
+                self.probing = False
+                if ok:
+                    self.outcomes.clear()
+                    self._set("closed")
+                    logger.info(f"CIRCUIT CLOSED: {self.name}")
+                else:
+                    self.opened_at = time.time()
+                    self._set("open")
+                return
+            self.outcomes.append(ok)
+            failures = self.outcomes.count(False)
+            if self.state == "closed" and len(self.outcomes) >= self.min_calls and \
+                    failures / len(self.outcomes) >= self.error_rate:
+                self.opened_at = time.time()
+                self.counts["opened"] += 1
+                self._set("open")
+                logger.warning(f"CIRCUIT OPEN: {self.name} | {failures}/{len(self.outcomes)} recent calls failed, failing fast for {self.cooldown}s")
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, state=self.state, recent_errors=self.outcomes.count(False), recent_calls=len(self.outcomes))
+
+class ApiGuard:
+    """Per-action adaptive timeout, hedging delay and circuit breaker for Apps Script calls.
+
+    Timeouts follow the action's observed latency (p99 x API_TIMEOUT_FACTOR within
+    [API_TIMEOUT_MIN, API_TIMEOUT_MAX]); until enough successful calls have been seen the
+    old flat API_TIMEOUT_MAX applies, and writes always get it. The timeout covers the
+    whole call: hedged reads send a second request once the first has taken longer than
+    the action's p95, within the same deadline, and nothing underneath retries.
+    """
+
+    def __init__(self):
+        self.latencies = {}  # action -> deque of recent successful call seconds
+        self.breakers = {}
+        self.lock = Lock()
+        self.counts = {}
+
+    def breaker(self, action):
+        with self.lock:
+            if action not in self.breakers:
+                self.breakers[action] = CircuitBreaker(action, BREAKER_WINDOW, BREAKER_MIN_CALLS,
+                                                       BREAKER_ERROR_RATE, BREAKER_COOLDOWN)
+                api_circuit_state.set(0, action)
+            return self.breakers[action]
+
+    def observe(self, action, seconds):
+        with self.lock:
+            self.latencies.setdefault(action, deque(maxlen=200)).append(seconds)
+
+    def _percentile(self, action, pct):
+        with self.lock:
+            samples = list(self.latencies.get(action, ()))
+        if len(samples) < API_LATENCY_MIN_SAMPLES:
+            return None
+        return percentile(samples, pct)
+
+    def timeout(self, action):
+        if not is_read_action(action):
+            return API_TIMEOUT_MAX  # a write cut short may still land upstream; give it the full time
+        p99 = self._percentile(action, 99)
+        if p99 is None:
+            return API_TIMEOUT_MAX
+        return min(API_TIMEOUT_MAX, max(API_TIMEOUT_MIN, p99 * API_TIMEOUT_FACTOR))
+
+    def hedge_delay(self, action):
+        p95 = self._percentile(action, 95)
+        return max(HEDGE_MIN_DELAY, p95 if p95 is not None else API_TIMEOUT_MAX / 4)
+
+    def stats(self):
+        with self.lock:
+            actions = list(self.latencies)
+            breakers = dict(self.breakers)
+        result = {}
+        for action in sorted(set(actions) | set(breakers)):
+            p95 = self._percentile(action, 95)
+            result[action] = {"timeout_s": round(self.timeout(action), 2),
+                              "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                              "circuit": breakers[action].stats() if action in breakers else None}
+        return result
+
+api_guard = ApiGuard()
+hedge_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="hedge") if IO_WORKERS > 0 else None
+
+def is_read_action(action):
+    """True for Apps Script actions that only read, so sending one twice is harmless"""
+    return action in API_READ_ACTIONS or action.startswith("export_")
+
+def _apps_get(params, timeout):
+    # no HTTP-level retries: the deadline, hedging and the circuit breaker are the whole retry policy
+    r = http_client.get(APPS_URL, params=params, timeout=(min(3.05, timeout), timeout), retry=False)
+    r.raise_for_status()
+    return r.json()
+
+def _bounded_get(params, timeout):
+    """_apps_get cut off after `timeout` in total: requests' read timeout restarts on every read and redirect"""
+    if hedge_pool is None:
+        return _apps_get(params, timeout)
+    return hedge_pool.submit(_apps_get, params, timeout).result(timeout=timeout)
+
+def _hedged_get(action, params, timeout):
+    """Send the read, and a second copy if the first is slower than the action's p95; first success wins"""
+    deadline = time.monotonic() + timeout
+    first = hedge_pool.submit(_apps_get, params, timeout)
+    try:
+        return first.result(timeout=min(api_guard.hedge_delay(action), timeout))
+    except FuturesTimeout:
+        pass
+    remaining = deadline - time.monotonic()
+    if remaining < 0.1:
+        return first.result(timeout=max(0, remaining))
+    second = hedge_pool.submit(_apps_get, params, remaining)
+    error = None
+    try:
+        for future in as_completed((first, second), timeout=remaining):
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            api_hedges.inc(action, "yes" if future is second else "no")
+            return result
+    except FuturesTimeout as e:
+        error = e
+    api_hedges.inc(action, "failed")
+    raise error
+
 def api_call(action, params):
     """Generic API call to Apps Script / unified API"""
     if not APPS_URL:
         logger.error("APPS_URL is not configured.")
         return None
+    breaker = api_guard.breaker(action)
+    if not breaker.allow():
+        api_short_circuits.inc(action)
+        return None
+    started = time.perf_counter()
     try:
         params = dict(params)  # copy avoid side effects
         params["action"] = action
         if APPS_SECRET:
             params["secret"] = APPS_SECRET
-        r = requests.get(APPS_URL, params=params, timeout=10)
-        r.raise_for_status()
-        return r.json()
+        timeout = api_guard.timeout(action)
+        if action in HEDGED_ACTIONS and hedge_pool is not None:
+            result = _hedged_get(action, params, timeout)
+        else:
+            result = _bounded_get(params, timeout)
     except Exception as e:
-        logger.error(f"API CALL FAILED: {action} | {e}")
+        logger.error(f"API CALL FAILED: {action} | {e or 'deadline exceeded'}")
+        api_errors.inc(action)
+        breaker.record(False)
+        if isinstance(e, FuturesTimeout):
+            api_guard.observe(action, time.perf_counter() - started)  # the call took at least this long
         return None
+    finally:
+        api_seconds.observe(time.perf_counter() - started, action)
+    api_guard.observe(action, time.perf_counter() - started)
+    breaker.record(True)
+    return result
+
+class ApiCache:
+    """Read-through cache in front of the Apps Script lookups.
+
+    Entries live for the per-action TTL in CACHE_TTLS, with a separate (usually shorter)
+    TTL for not-found answers so repeated unknown barcodes/tokens stop reaching Apps Script.
+    Concurrent misses for the same key share one upstream call, and the cache is an LRU
+    capped at CACHE_MAX entries. Failed calls (None) are never cached; instead an entry that
+    expired less than CACHE_STALE_FOR ago is served stale, so an Apps Script outage (or an
+    open circuit breaker) degrades to yesterday's answer rather than an error.
+    """
+
+    def __init__(self, ttls, max_size):
+        self.ttls = ttls
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (action, params) -> (value, expires)
+        self.inflight = {}  # (action, params) -> Future shared by coalesced callers
+        self.lock = Lock()
+        self.counts = {}
+
+    def _count(self, action, key):
+        per_action = self.counts.setdefault(action, {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0, "stale": 0, "evictions": 0})
+        per_action[key] += 1
+
+    @staticmethod
+    def is_negative(value):
+        return isinstance(value, dict) and (value.get("found") is False or value.get("valid") is False)
+
+    def get(self, action, params, loader):
+        if action not in self.ttls:
+            return loader()
+        key = (action, tuple(sorted(params.items())))
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] > now:
+                self.entries.move_to_end(key)
+                self._count(action, "negative_hits" if self.is_negative(entry[0]) else "hits")
+                return copy.deepcopy(entry[0])
+            waiter = self.inflight.get(key)
+            leader = waiter is None
+            if leader:
+                waiter = self.inflight[key] = Future()
+                self._count(action, "misses")
+            else:
+                self._count(action, "coalesced")
+        if not leader:
+            return copy.deepcopy(waiter.result())
+        value = stale = None
+        try:
+            value = loader()
+            if value is None:
+                value = stale = self._stale(action, key)
+        finally:
+            self._store(action, key, None if stale else value)  # a stale answer keeps its old expiry
+            waiter.set_result(value)
+        return copy.deepcopy(value)
+
+    def _stale(self, action, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry or entry[1] + CACHE_STALE_FOR < time.time():
+                return None
+            self._count(action, "stale")
+        api_stale.inc(action)
+        logger.warning(f"SERVING STALE: {action} (Apps Script unavailable)")
+        return entry[0]
+
+    def _store(self, action, key, value):
+        found_ttl, negative_ttl = self.ttls[action]
+        ttl = negative_ttl if self.is_negative(value) else found_ttl
+        with self.lock:
+            del self.inflight[key]
+            if value is None or ttl <= 0:
+                return
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                evicted_key, _ = self.entries.popitem(last=False)
+                self._count(evicted_key[0], "evictions")
+
+    def invalidate(self, action, params):
+        with self.lock:
+            self.entries.pop((action, tuple(sorted(params.items()))), None)
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "max_size": self.max_size, "actions": copy.deepcopy(self.counts)}
+
+api_cache = ApiCache(CACHE_TTLS, CACHE_MAX)
+
+def cached_api_call(action, params):
+    """api_call through the read-through cache (uncached for actions not in CACHE_TTLS)"""
+    return api_cache.get(action, params, lambda: api_call(action, params))
+
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io") if IO_WORKERS > 0 else None
+
+def in_background(fn, *args):
+    """Start an upstream call that the turn does not need yet; returns a Future.
+
+    Sends never go through here: they already leave the turn's thread via the outbound
+    scheduler, in order per recipient.
+    """
+    if io_pool is None:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return io_pool.submit(fn, *args)
+
+# ==================== LOCAL REPLICA (reference data) ====================
+class ReplicaTable:
+    """In-memory copy of one Apps Script reference table, indexed by its key fields.
+
+    A sync calls the table's export action once. Without a cursor the answer is taken as
+    the whole table and swapped in; with a cursor ("since" = the previous as_of) only the
+    changed "rows" and "deleted" keys are applied.
+    """
+
+    def __init__(self, name, action, key_fields):
+        self.name = name
+        self.action = action
+        self.key_fields = key_fields
+        self.index = {}
+        self.cursor = None
+        self.synced_at = None
+        self.counts = {"syncs": 0, "full_syncs": 0, "failures": 0, "hits": 0, "misses": 0}
+        self.last_sync_ms = 0
+
+    def key(self, row):
+        values = tuple(str(row.get(f, "")).strip().upper() for f in self.key_fields)
+        return values[0] if len(values) == 1 else values
+
+    def get(self, key):
+        row = self.index.get(key)
+        self.counts["hits" if row is not None else "misses"] += 1
+        return row
+
+    def sync(self, full=False):
+        started = time.time()
+        params = {} if full or not self.cursor else {"since": self.cursor}
+        result = api_call(self.action, params)
+        if not isinstance(result, dict) or not isinstance(result.get("rows"), list):
+            self.counts["failures"] += 1
+            logger.warning(f"REPLICA SYNC FAILED: {self.name}")
+            return False
+        if "since" in params and not result.get("full"):
+            for key in result.get("deleted", []):
+                self.index.pop(self.key(key) if isinstance(key, dict) else str(key).upper(), None)
+            for row in result["rows"]:
+                self.index[self.key(row)] = row
+        else:
+            self.index = {self.key(row): row for row in result["rows"]}
+            self.counts["full_syncs"] += 1
+        self.cursor = result.get("as_of") or self.cursor
+        self.synced_at = time.time()
+        self.counts["syncs"] += 1
+        self.last_sync_ms = (self.synced_at - started) * 1000
+        return True
+
+    def stats(self):
+        age = round(time.time() - self.synced_at, 1) if self.synced_at else None
+        return dict(self.counts, rows=len(self.index), age_seconds=age, cursor=self.cursor,
+                    last_sync_ms=round(self.last_sync_ms, 1))
+
+class TokenFilter:
+    """Bloom filter of every issued warranty token plus the exact set of redeemed ones.
+
+    Synced with the other replica tables from the export_tokens action, which answers
+    {"issued": [...], "redeemed": [...], "as_of": ...}; with a cursor only new entries are
+    sent and added. A Bloom filter cannot forget, so revoked tokens drop out on the
+    periodic full sync, which also resizes it for TOKEN_FILTER_FP_RATE. Tokens are issued
+    when cards are printed, well before a customer can hold one, so a fresh filter never
+    rejects a real card; a filter older than TOKEN_FILTER_MAX_AGE is not used to reject.
+    """
+
+    def __init__(self, name, action, fp_rate):
+        self.name = name
+        self.action = action
+        self.fp_rate = fp_rate
+        self.bits = bytearray(0)
+        self.m = 0
+        self.k = 0
+        self.issued = 0
+        self.redeemed = set()
+        self.cursor = None
+        self.synced_at = None
+        self.lock = Lock()
+        self.counts = {"syncs": 0, "full_syncs": 0, "failures": 0, "rejected_invalid": 0,
+                       "rejected_redeemed": 0, "passed": 0, "confirmed_valid": 0, "false_positives": 0}
+        self.last_sync_ms = 0
+
+    def _positions(self, token):
+        digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def _add(self, token):
+        for pos in self._positions(token):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def _might_contain(self, token):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(token))
+
+    def _rebuild(self, tokens):
+        n = max(1000, int(len(tokens) * 1.25))  # headroom for delta-synced additions
+        self.m = int(-n * math.log(self.fp_rate) / math.log(2) ** 2)
+        self.k = max(1, round(self.m / n * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        for token in tokens:
+            self._add(str(token).upper())
+        self.issued = len(tokens)
+
+    def sync(self, full=False):
+        started = time.time()
+        params = {} if full or not self.cursor else {"since": self.cursor}
+        result = api_call(self.action, params)
+        if not isinstance(result, dict) or not isinstance(result.get("issued"), list):
+            self.counts["failures"] += 1
+            logger.warning(f"REPLICA SYNC FAILED: {self.name}")
+            return False
+        redeemed = {str(t).upper() for t in result.get("redeemed", [])}
+        with self.lock:
+            if "since" in params and not result.get("full"):
+                for token in result["issued"]:
+                    self._add(str(token).upper())
+                self.issued += len(result["issued"])
+                self.redeemed |= redeemed
+            else:
+                self._rebuild(result["issued"])
+                self.redeemed = redeemed
+                self.counts["full_syncs"] += 1
+            self.cursor = result.get("as_of") or self.cursor
+            self.synced_at = time.time()
+            self.counts["syncs"] += 1
+        self.last_sync_ms = (self.synced_at - started) * 1000
+        return True
+
+    def check(self, token):
+        """"invalid" or "redeemed" when that is certain locally, "maybe" if Apps Script must decide, None if unsynced"""
+        token = token.upper()
+        with self.lock:
+            if not self.synced_at or time.time() - self.synced_at > TOKEN_FILTER_MAX_AGE:
+                return None
+            if not self._might_contain(token):
+                verdict = "invalid"
+            elif token in self.redeemed:
+                verdict = "redeemed"
+            else:
+                verdict = "maybe"
+            self.counts["rejected_" + verdict if verdict != "maybe" else "passed"] += 1
+        return verdict
+
+    def record_upstream(self, valid):
+        """Apps Script's answer for a token the filter passed; an invalid one was a false positive"""
+        with self.lock:
+            self.counts["confirmed_valid" if valid else "false_positives"] += 1
+
+    def stats(self):
+        with self.lock:
+            age = round(time.time() - self.synced_at, 1) if self.synced_at else None
+            fill = bin(int.from_bytes(self.bits, "little")).count("1") / self.m if self.m else 0
+            decided = self.counts["false_positives"] + self.counts["rejected_invalid"]
+            return dict(self.counts, issued=self.issued, redeemed=len(self.redeemed), bytes=len(self.bits),
+                        hashes=self.k, age_seconds=age, cursor=self.cursor, last_sync_ms=round(self.last_sync_ms, 1),
+                        estimated_fp_rate=round(fill ** self.k, 6) if self.k else None,
+                        observed_fp_rate=round(self.counts["false_positives"] / decided, 6) if decided else None)
+
+class Replica:
+    """Periodically synced local copy of the product catalogue, care texts, cashback ledger and issued tokens"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.tables = {
+            "products": ReplicaTable("products", "export_products", ("code",)),
+            "care": ReplicaTable("care", "export_care", ("category",)),
+            "cashback": ReplicaTable("cashback", "export_cashback", ("code", "month")),
+            "tokens": TokenFilter("tokens", "export_tokens", TOKEN_FILTER_FP_RATE),
+        }
+        self.rounds = 0
+        self.first_round = Event()  # set once every table has made its first sync attempt, successful or not
+
+    def lookup(self, table, key):
+        return self.tables[table].get(key)
+
+    def sync_all(self):
+        full = self.rounds % REPLICA_FULL_SYNC_EVERY == 0
+        for table in self.tables.values():
+            table.sync(full=full)
+        self.rounds += 1
+
+    def _loop(self):
+        while True:
+            try:
+                self.sync_all()
+            except Exception as e:
+                logger.error(f"REPLICA SYNC ERROR: {e}")
+            self.first_round.set()
+            for table in self.tables.values():
+                if table.synced_at and time.time() - table.synced_at > 3 * self.interval:
+                    logger.warning(f"REPLICA STALE: {table.name} last synced {int(time.time() - table.synced_at)}s ago")
+            time.sleep(self.interval)
+
+    def start(self):
+        if self.interval > 0 and APPS_URL:
+            Thread(target=self._loop, name="replica-sync", daemon=True).start()
+
+    def stats(self):
+        return {name: table.stats() for name, table in self.tables.items()}
+
+replica = Replica(REPLICA_SYNC_INTERVAL)
+replica.start()
+token_filter = replica.tables["tokens"]
 
 def verify_warranty_token(token):
-    return api_call("verify_token", {"token": token})
+    return cached_api_call("verify_token", {"token": token})
+
+def lookup_product(code):
+    # answered from the local replica when it has the row, live Apps Script otherwise
+    row = replica.lookup("products", code.strip().upper())
+    return dict(row, found=True) if row else cached_api_call("lookup_barcode", {"code": code})
+
+def fetch_care(category):
+    """Care instructions text for a product category (None if unknown or unavailable)"""
+    if not category:
+        return None
+    care_result = replica.lookup("care", str(category).strip().upper()) or \
+        cached_api_call("get_care_instructions", {"category": category})
+    if care_result and care_result.get("care_instructions"):
+        return care_result["care_instructions"]
+    return None
 
 def lookup_barcode(code):
     # KISS: lookup barcode and also fetch care instructions based on category
-    result = api_call("lookup_barcode", {"code": code})
+    result = lookup_product(code)
     if result and result.get("found"):
-        category = result.get("category")
-        if category:
-            care_result = api_call("get_care_instructions", {"category": category})
-            if care_result and care_result.get("care_instructions"):
-                result["care_instructions"] = care_result["care_instructions"]
+        care = fetch_care(result.get("category"))
+        if care:
+            result["care_instructions"] = care
     return result
 
-def register_warranty(token, barcode, phone):
-    return api_call("register_warranty", {"token": token, "barcode": barcode, "phone": phone})
+def register_warranty(token, barcode, phone, request_id=None):
+    params = {"token": token, "barcode": barcode, "phone": phone}
+    if request_id:
+        params["request_id"] = request_id  # lets Apps Script ignore a retried registration it already stored
+    return api_call("register_warranty", params)
+
+WARRANTY_TOKEN_RE = re.compile(r'^\s*GAJA\s+([A-Z0-9]{8})\s*$')
+BARCODE_RE = re.compile(r'^\d{6}$')  # the code on the MRP sticker
 
 def detect_warranty_token(text):
     """Detect token of form 'GAJA <8 chars>' (case-insensitive)"""
-    if not text:
+    if not text or text.lstrip()[:4].upper() != "GAJA":  # cheap reject before the regex
         return None
-    match = re.match(r'^\s*GAJA\s+([A-Z0-9]{8})\s*$', text.upper())
+    match = WARRANTY_TOKEN_RE.match(text.upper())
     if match:
         return match.group(1)
     return None
@@ -179,94 +2075,209 @@ def detect_warranty_token(text):
 def format_date(iso_date):
     """Format ISO date to readable format"""
     try:
-        from datetime import datetime
         dt = datetime.fromisoformat(iso_date.replace('Z', '+00:00'))
         return dt.strftime("%d %b %Y")
     except:
         return iso_date
 
+# ==================== WARRANTY JOURNAL (write-behind) ====================
+class WarrantyJournal:
+    """Durable local record of accepted warranty registrations, committed to Apps Script in the background.
+
+    accept() validates locally (one token, one registration), writes the row to SQLite and
+    returns straight away, so the user is confirmed without waiting on Apps Script. A
+    committer thread sends pending rows in batches of WARRANTY_COMMIT_BATCH; a row Apps
+    Script does not answer is retried with capped exponential backoff, and one it rejects
+    is reported to the user and to Pumble, unless an unanswered earlier attempt already
+    took the token. The idempotency key is token:barcode:phone, so a repeated submission
+    of the same registration is accepted again rather than refused.
+    """
+
+    def __init__(self, path):
+        self.cond = Condition()
+        self.commit_lock = Lock()  # one committer pass at a time (background thread or shutdown flush)
+        self.tokens = {}  # token -> idem_key of its pending or recently committed registration
+        self.counts = {"accepted": 0, "duplicates": 0, "committed": 0, "rejected": 0, "retries": 0}
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS warranty_journal ("
+            "idem_key TEXT PRIMARY KEY, token TEXT NOT NULL, barcode TEXT NOT NULL, phone TEXT NOT NULL, "
+            "lang TEXT, created_at REAL NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt REAL NOT NULL, last_error TEXT)"
+        )
+        self.db.execute("DELETE FROM warranty_journal WHERE status != 'pending' AND created_at < ?",
+                        (time.time() - WARRANTY_JOURNAL_KEEP,))
+        for idem_key, token in self.db.execute(
+                "SELECT idem_key, token FROM warranty_journal WHERE status IN ('pending', 'committed')"):
+            self.tokens[token] = idem_key
+
+    @staticmethod
+    def key(token, barcode, phone):
+        return f"{token}:{barcode}:{phone}"
+
+    def claimed(self, token, phone=None):
+        """True if the token already backs a registration (other than this phone's own pending one)"""
+        with self.cond:
+            idem_key = self.tokens.get(token)
+        return idem_key is not None and not (phone and idem_key.endswith(f":{phone}"))
+
+    def accept(self, token, barcode, phone, lang):
+        """Journal a registration; returns False if the token is already used by another one"""
+        idem_key = self.key(token, barcode, phone)
+        with self.cond:
+            existing = self.tokens.get(token)
+            if existing is not None and existing != idem_key:
+                self.counts["duplicates"] += 1
+                return False
+            if existing is None:
+                now = time.time()
+                # a resubmission of a registration Apps Script rejected earlier is queued again, not ignored
+                self.db.execute(
+                    "INSERT INTO warranty_journal (idem_key, token, barcode, phone, lang, created_at, status, next_attempt) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 'pending', ?) ON CONFLICT(idem_key) DO UPDATE SET status = 'pending', "
+                    "lang = excluded.lang, created_at = excluded.created_at, attempts = 0, "
+                    "next_attempt = excluded.next_attempt, last_error = NULL WHERE status = 'rejected'",
+                    (idem_key, token, barcode, phone, lang, now, now))
+                self.tokens[token] = idem_key
+                self.counts["accepted"] += 1
+                self.cond.notify()
+        return True
+
+    def start(self):
+        Thread(target=self._committer, name="warranty-committer", daemon=True).start()
+
+    def _committer(self):
+        while True:
+            with self.cond:
+                self.cond.wait(WARRANTY_COMMIT_INTERVAL)
+            try:
+                while self.commit_due():
+                    pass
+            except Exception as e:
+                logger.exception(f"WARRANTY COMMITTER FAILED: {e}")
+
+    def flush(self, timeout):
+        """Commit whatever is due before shutdown; rows left pending stay journaled for the next start"""
+        deadline = time.time() + timeout
+        while time.time() < deadline and self.commit_due():
+            pass
+
+    def commit_due(self):
+        """Send one batch of due registrations; True if the batch was full (more may be waiting)"""
+        with self.commit_lock:
+            return self._commit_batch()
+
+    def _commit_batch(self):
+        now = time.time()
+        rows = self.db.execute(
+            "SELECT idem_key, token, barcode, phone, lang, attempts FROM warranty_journal "
+            "WHERE status = 'pending' AND next_attempt <= ? ORDER BY created_at LIMIT ?",
+            (now, WARRANTY_COMMIT_BATCH)).fetchall()
+        updates, rejected = [], []
+        for idem_key, token, barcode, phone, lang, attempts in rows:
+            result = register_warranty(token, barcode, phone, request_id=idem_key)
+            if result is None:
+                backoff = min(WARRANTY_RETRY_MAX, 5 * 2 ** attempts) * random.uniform(0.8, 1.2)
+                updates.append(("pending", attempts + 1, now + backoff, "no answer", idem_key))
+                self.counts["retries"] += 1
+            elif result.get("success") or (attempts and self._landed_earlier(token, result)):
+                updates.append(("committed", attempts + 1, now, None, idem_key))
+                self.counts["committed"] += 1
+            else:
+                updates.append(("rejected", attempts + 1, now, str(result.get("error") or result)[:200], idem_key))
+                rejected.append((token, barcode, phone, lang, result))
+        if updates:
+            with self.cond:
+                self.db.execute("BEGIN")
+                self.db.executemany("UPDATE warranty_journal SET status = ?, attempts = ?, next_attempt = ?, last_error = ? "
+                                    "WHERE idem_key = ?", updates)
+                self.db.execute("COMMIT")
+                for token, *_ in rejected:
+                    self.tokens.pop(token, None)
+                    self.counts["rejected"] += 1
+        for token, barcode, phone, lang, result in rejected:
+            logger.error(f"WARRANTY REJECTED: {phone} | Token: {token} | {barcode} | {result.get('error')}")
+            pumble.notify(f"WARRANTY REJECTED | {phone} | Token: {token} | Barcode: {barcode} | {result.get('error')}")
+            send_template("warranty_rejected", lang or "en", phone, token=token)
+        return len(rows) == WARRANTY_COMMIT_BATCH
+
+    @staticmethod
+    def _landed_earlier(token, result):
+        """True if a refusal is most likely our own unanswered earlier attempt having gone through.
+
+        Only this journal registers a token the local check let through, so a token Apps Script
+        now reports as valid but taken, after an attempt that got no answer, is taken by us.
+        """
+        check = api_call("verify_token", {"token": token})  # not cached: the answer has to be current
+        if not check or not check.get("valid") or check.get("available"):
+            return False
+        logger.warning(f"WARRANTY PRESUMED COMMITTED: {token} | refused after an unanswered attempt | {result.get('error')}")
+        return True
+
+    def stats(self):
+        with self.cond:
+            pending, oldest = self.db.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM warranty_journal WHERE status = 'pending'").fetchone()
+            return dict(self.counts, pending=pending,
+                        oldest_pending_s=round(time.time() - oldest, 1) if oldest else 0)
+
+warranty_journal = WarrantyJournal(JOB_DB_PATH)
+if WARRANTY_WRITE_BEHIND:
+    warranty_journal.start()
+
 # ==================== WARRANTY FLOW (replaced with KISS flow) ====================
 def send_warranty_confirmation(to, lang, registration, product):
     """Send simple warranty confirmation with buttons"""
-    if lang == "en":
-        msg = (
-            "🎉 *WARRANTY REGISTERED!*\n"
-            "━━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"📦 *Product:* {product.get('sku_name', 'N/A')}\n"
-            f"🏷️ *Category:* {product.get('category', 'N/A')}\n"
-            f"⏰ *Warranty:* {registration.get('warranty_months', 0)} months\n\n"
-            "✅ Your warranty is now active!"
-        )
-    else:  # Tamil fallback
-        msg = (
-            "🎉 *வாரன்டி பதிவு செய்யப்பட்டது!*\n"
-            "━━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"📦 *பொருள்:* {product.get('sku_name', 'N/A')}\n"
-            f"🏷️ *வகை:* {product.get('category', 'N/A')}\n"
-            f"⏰ *வாரன்டி:* {registration.get('warranty_months', 0)} மாதங்கள்\n\n"
-            "✅ உங்கள் வாரன்டி செயலில் உள்ளது!"
-        )
-    
-    # Send confirmation message
-    send_text(to, msg)
-    
+    months = registration.get("warranty_months")
+    if months:
+        send_template("warranty_confirmation", lang, to,
+                      sku_name=product.get("sku_name", "N/A"), category=product.get("category", "N/A"),
+                      warranty_months=months)
+    else:
+        send_template("warranty_accepted", lang, to,
+                      sku_name=product.get("sku_name", "N/A"), category=product.get("category", "N/A"))
     # Send buttons for care & T&C
-    button_msg = "Learn more:" if lang == "en" else "மேலும் அறிய:"
-    buttons = [
-        {"id": "warr_care", "title": "🛠️ Care Tips" if lang == "en" else "🛠️ பராமரிப்பு"},
-        {"id": "warr_tc", "title": "📋 Terms" if lang == "en" else "📋 விதிமுறைகள்"},
-        {"id": "warr_close", "title": "✖️ Close" if lang == "en" else "✖️ மூடு"}
-    ]
-    send_buttons(to, button_msg, buttons)
+    send_template("warranty_learn_more", lang, to)
 
 def send_care_instructions(to, lang, product):
     """Send care instructions"""
-    care = product.get("care_instructions", "No care instructions available")
-    category = product.get("category", "Product")
-    
-    if lang == "en":
-        msg = (
-            f"🛠️ *CARE INSTRUCTIONS*\n"
-            f"{category}\n\n"
-            f"{care}\n\n"
-            "Follow these tips to maximize your product's lifespan!"
-        )
-    else:
-        msg = (
-            f"🛠️ *பராமரிப்பு வழிமுறைகள்*\n"
-            f"{category}\n\n"
-            f"{care}\n\n"
-            "உங்கள் பொருளின் ஆயுளை அதிகரிக்க இந்த குறிப்புகளைப் பின்பற்றவும்!"
-        )
-    
-    send_text(to, msg)
-    
+    send_template("care_instructions", lang, to,
+                  category=product.get("category", "Product"),
+                  care=product.get("care_instructions", "No care instructions available"))
     # Offer to close
-    buttons = [{"id": "warr_close", "title": "✖️ Close" if lang == "en" else "✖️ மூடு"}]
-    send_buttons(to, "Anything else?" if lang == "en" else "வேறு ஏதாவது?", buttons)
+    send_template("anything_else", lang, to)
 
 def send_warranty_tc(to, lang):
     """Send warranty terms & conditions (English only)"""
-    msg = WARRANTY_TC.format(phone=GAJA_PHONE)
-    send_text(to, msg)
-    
+    send_template("warranty_tc", lang, to)
     # Offer to close
-    buttons = [{"id": "warr_close", "title": "✖️ Close" if lang == "en" else "✖️ மூடு"}]
-    send_buttons(to, "Anything else?" if lang == "en" else "வேறு ஏதாவது?", buttons)
+    send_template("anything_else", lang, to)
 
 def ask_for_barcode(frm, lang):
-    msg = (
-        "✅ Warranty token verified!\n\n"
-        "📦 Next step: Enter the 6-digit code from your product's MRP sticker.\n\n"
-        "Example: 528941\n\n"
-        "Please type the 6-digit code:"
+    send_template("ask_barcode", lang, frm)
+
+def token_used_text(lang):
+    return (
+        "❌ This warranty token is already registered!\n\n"
+        "Each warranty card can only be used once.\n\n"
+        f"For assistance, call {GAJA_PHONE}"
+    ) if lang == "en" else (
+        "❌ இந்த வாரன்டி டோக்கன் ஏற்கனவே பதிவு செய்யப்பட்டது!\n\n"
+        "ஒவ்வொரு வாரன்டி கார்டும் ஒரு முறை மட்டுமே பயன்படுத்தப்படும்.\n\n"
+        f"உதவிக்கு {GAJA_PHONE} அழைக்கவும்"
+    )
+
+def invalid_token_text(lang):
+    return (
+        "❌ Invalid warranty token!\n\n"
+        "This token does not exist in our system.\n\n"
+        f"Please check your warranty card or call {GAJA_PHONE}"
     ) if lang == "en" else (
-        "✅ வாரன்டி டோக்கன் சரிபார்க்கப்பட்டது!\n\n"
-        "📦 அடுத்தது: உங்கள் பொருளின் MRP ஸ்டிக்கரில் உள்ள 6-இலக்க குறியீட்டை உள்ளிடவும்.\n\n"
-        "உதாரணம்: 528941\n\n"
-        "6-இலக்க குறியீட்டை தட்டச்சு செய்யவும்:"
+        "❌ தவறான வாரன்டி டோக்கன்!\n\n"
+        "இந்த டோக்கன் எங்கள் அமைப்பில் இல்லை.\n\n"
+        f"உங்கள் வாரன்டி கார்டை சரிபார்க்கவும் அல்லது {GAJA_PHONE} அழைக்கவும்"
     )
-    send_text(frm, msg)
 
 def handle_warranty_start(frm, session, token):
     logger.info(f"WARRANTY TOKEN DETECTED: {token} from {frm}")
@@ -275,8 +2286,14 @@ def handle_warranty_start(frm, session, token):
     if not session.get("lang"):
         session["lang"] = "en"
 
-    status_msg = "⏳ Verifying your warranty token..." if session["lang"] == "en" else "⏳ உங்கள் வாரன்டி டோக்கனை சரிபார்க்கிறது..."
-    send_text(frm, status_msg)
+    # typos, guesses and already-used cards are answered from the local token filter
+    known = token_filter.check(token)
+    if known in ("invalid", "redeemed"):
+        send_text(frm, invalid_token_text(session["lang"]) if known == "invalid" else token_used_text(session["lang"]))
+        end_session(frm)
+        return
+
+    send_template("status_verifying", session["lang"], frm)
 
     result = verify_warranty_token(token)
 
@@ -287,41 +2304,20 @@ def handle_warranty_start(frm, session, token):
             f"❌ கணினி பிழை. பின்னர் முயற்சிக்கவும் அல்லது {GAJA_PHONE} அழைக்கவும்"
         )
         send_text(frm, error)
-        with lock:
-            if frm in sessions:
-                del sessions[frm]
+        end_session(frm)
         return
 
+    if known == "maybe":
+        token_filter.record_upstream(bool(result.get("valid")))
+
     if not result.get("valid"):
-        error = (
-            "❌ Invalid warranty token!\n\n"
-            "This token does not exist in our system.\n\n"
-            f"Please check your warranty card or call {GAJA_PHONE}"
-        ) if session["lang"] == "en" else (
-            "❌ தவறான வாரன்டி டோக்கன்!\n\n"
-            "இந்த டோக்கன் எங்கள் அமைப்பில் இல்லை.\n\n"
-            f"உங்கள் வாரன்டி கார்டை சரிபார்க்கவும் அல்லது {GAJA_PHONE} அழைக்கவும்"
-        )
-        send_text(frm, error)
-        with lock:
-            if frm in sessions:
-                del sessions[frm]
+        send_text(frm, invalid_token_text(session["lang"]))
+        end_session(frm)
         return
 
-    if not result.get("available"):
-        error = (
-            "❌ This warranty token is already registered!\n\n"
-            "Each warranty card can only be used once.\n\n"
-            f"For assistance, call {GAJA_PHONE}"
-        ) if session["lang"] == "en" else (
-            "❌ இந்த வாரன்டி டோக்கன் ஏற்கனவே பதிவு செய்யப்பட்டது!\n\n"
-            "ஒவ்வொரு வாரன்டி கார்டும் ஒரு முறை மட்டுமே பயன்படுத்தப்படும்.\n\n"
-            f"உதவிக்கு {GAJA_PHONE} அழைக்கவும்"
-        )
-        send_text(frm, error)
-        with lock:
-            if frm in sessions:
-                del sessions[frm]
+    if not result.get("available") or warranty_journal.claimed(token, frm):
+        send_text(frm, token_used_text(session["lang"]))
+        end_session(frm)
         return
 
     # token valid & available -> ask barcode
@@ -333,7 +2329,7 @@ def handle_warranty_start(frm, session, token):
 def handle_barcode_input(frm, session, raw_code):
     code = raw_code.strip()
 
-    if not re.match(r'^\d{6}$', code):
+    if not BARCODE_RE.match(code):
         error = (
             "❌ Invalid code format!\n\n"
             "Please enter exactly 6 digits from your MRP sticker.\n\n"
@@ -347,10 +2343,9 @@ def handle_barcode_input(frm, session, raw_code):
         ask_for_barcode(frm, session["lang"])
         return
 
-    status_msg = "⏳ Looking up your product..." if session["lang"] == "en" else "⏳ உங்கள் பொருளைத் தேடுகிறது..."
-    send_text(frm, status_msg)
+    send_template("status_looking_up", session["lang"], frm)
 
-    product = lookup_barcode(code)
+    product = lookup_product(code)
 
     if not product or not product.get("found"):
         error = (
@@ -366,10 +2361,20 @@ def handle_barcode_input(frm, session, raw_code):
         ask_for_barcode(frm, session["lang"])
         return
 
-    status_msg = "⏳ Registering your warranty..." if session["lang"] == "en" else "⏳ உங்கள் வாரன்டியை பதிவு செய்கிறது..."
-    send_text(frm, status_msg)
-
-    result = register_warranty(session["warranty_token"], code, frm)
+    send_template("status_registering", session["lang"], frm)
+
+    # care instructions only depend on the category, so fetch them while registering
+    care = in_background(fetch_care, product.get("category"))
+    if WARRANTY_WRITE_BEHIND:
+        # journaled locally and confirmed now; the committer registers it with Apps Script
+        if not warranty_journal.accept(session["warranty_token"], code, frm, session["lang"]):
+            send_text(frm, token_used_text(session["lang"]))
+            end_session(frm)
+            return
+        # the duration is only known once Apps Script stores it, so it is shown only if the product row has it
+        result = {"success": True, "warranty_months": product.get("warranty_months")}
+    else:
+        result = register_warranty(session["warranty_token"], code, frm)
 
     if not result or not result.get("success"):
         error = (
@@ -380,65 +2385,67 @@ def handle_barcode_input(frm, session, raw_code):
             f"பின்னர் முயற்சிக்கவும் அல்லது {GAJA_PHONE} அழைக்கவும்"
         )
         send_text(frm, error)
-        with lock:
-            if frm in sessions:
-                del sessions[frm]
+        end_session(frm)
         return
 
     # success -> send confirmation
     # Store product info for later use (care/tc buttons)
+    try:
+        if care.result(timeout=15):
+            product["care_instructions"] = care.result()
+    except Exception as e:
+        logger.error(f"CARE LOOKUP FAILED: {product.get('category')} | {e}")
     session["warranty_product"] = product
     session["state"] = "warranty_complete"
     save_session(frm, session)
 
     send_warranty_confirmation(frm, session["lang"], result, product)
 
-    if PUMBLE_WEBHOOK:
-        try:
-            # Using Script 1's Pumble format per your instruction
-            requests.post(PUMBLE_WEBHOOK, json={
-                "text": f"WARRANTY | {frm} | Token: {session['warranty_token']} | Product: {product.get('sku_name')} | {result.get('warranty_months')}mo"
-            }, timeout=5)
-        except:
-            pass
+    # Using Script 1's Pumble format per your instruction
+    pumble.notify(f"WARRANTY | {frm} | Token: {session['warranty_token']} | Product: {product.get('sku_name')} | {result.get('warranty_months') or '?'}mo")
 
-    with lock:
-        # keep the session (so user can press Care/Terms), but we won't delete it here
-        pass
+    # keep the session (so user can press Care/Terms), but we won't delete it here
 
     logger.info(f"WARRANTY REGISTERED: {session.get('warranty_token')} | {frm} | {product.get('sku_name')}")
 
 # ==================== CASHBACK FLOW (Carpenter) ====================
+def timed_lookup(name):
+    """Decorator recording a lookup's latency, and a None (upstream failure) answer as an error"""
+    def wrap(fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            result = fn(*args, **kwargs)
+            lookup_seconds.observe(time.perf_counter() - started, name)
+            if result is None:
+                lookup_errors.inc(name)
+            return result
+        timed.__name__ = fn.__name__
+        timed.__doc__ = fn.__doc__
+        return timed
+    return wrap
+
+@timed_lookup("fetch_months")
 def fetch_months():
-    try:
-        params = {"action": "months", "latest": "3"}
-        if APPS_SECRET: params["secret"] = APPS_SECRET
-        r = requests.get(APPS_URL, params=params, timeout=10)
-        r.raise_for_status()
-        return r.json().get("months", [])[:3]
-    except: 
+    result = cached_api_call("months", {"latest": "3"})
+    if result is None:
         return None
+    return result.get("months", [])[:3]
 
+@timed_lookup("fetch_cashback")
 def fetch_cashback(code, month):
-    try:
-        params = {"action": "cashback", "code": code, "month": month}
-        if APPS_SECRET: params["secret"] = APPS_SECRET
-        r = requests.get(APPS_URL, params=params, timeout=10)
-        r.raise_for_status()
-        return r.json()
-    except:
-        return None
+    row = replica.lookup("cashback", (code.strip().upper(), str(month).strip().upper()))
+    if row:
+        return dict(row, found=True)
+    return cached_api_call("cashback", {"code": code, "month": month})
 
 def ask_carpenter_code(to, lang):
-    msg = "Please enter your Carpenter Code (e.g. ABC123)" if lang == "en" else "உங்கள் கார்பென்டர் கோடை உள்ளிடவும் (எ.கா. ABC123)"
-    send_text(to, msg + "\n\nType 0 to go back")
+    send_template("ask_carpenter_code", lang, to)
 
 def handle_carpenter_code(to, session, raw_code):
     code = raw_code.strip().upper()
     session["carpenter_code"] = code
     save_session(to, session)
-    status_msg = "⏳ Checking available months..." if session["lang"]=="en" else "⏳ மாதங்கள் சரிபார்க்கப்படுகிறது..."
-    send_text(to, status_msg)
+    send_template("status_checking_months", session["lang"], to)
     months = fetch_months()
     if not months:
         msg = f"Temporary issue. Please try later or call {GAJA_PHONE}" if session["lang"]=="en" else f"தற்காலிக பிரச்சனை. பின்னர் முயற்சிக்கவும் அல்லது {GAJA_PHONE} அழைக்கவும்"
@@ -459,8 +2466,7 @@ def handle_month_selection(to, session, list_id):
     except:
         send_text(to, "Invalid selection.")
         return
-    status_msg = "⏳ Fetching your cashback details..." if session["lang"]=="en" else "⏳ உங்கள் கேஷ்பேக் விவரங்கள் பெறப்படுகிறது..."
-    send_text(to, status_msg)
+    send_template("status_fetching_cashback", session["lang"], to)
     data = fetch_cashback(session["carpenter_code"], month)
     if not data:
         msg = f"Server down. Try later or call {GAJA_PHONE}" if session["lang"]=="en" else f"சர்வர் பழுது. பின்னர் முயற்சி அல்லது {GAJA_PHONE} அழைக்கவும்"
@@ -471,13 +2477,8 @@ def handle_month_selection(to, session, list_id):
     else:
         name = data.get("name", "Carpenter")
         amt = data.get("cashback_amount", 0)
-        msg = f"Hello {name}!\n\nCashback for {month}: ₹{amt}\n\nTransferred by month end.\nCall {GAJA_PHONE} for queries." if session["lang"]=="en" else f"வணக்கம் {name}!\n\n{month} கேஷ்பேக்: ₹{amt}\n\nமாத இறுதிக்குள் வரவு வைக்கப்படும்.\n{GAJA_PHONE} அழைக்கவும்."
-        send_text(to, msg)
-        if PUMBLE_WEBHOOK:
-            try:
-                requests.post(PUMBLE_WEBHOOK, json={"text": f"CASHBACK | {to} | {session['carpenter_code']} | {month} | ₹{amt}"}, timeout=5)
-            except:
-                pass
+        send_template("cashback_result", session["lang"], to, name=name, month=month, amount=amt)
+        pumble.notify(f"CASHBACK | {to} | {session['carpenter_code']} | {month} | ₹{amt}")
     session.pop("months", None)
     session.pop("carpenter_code", None)
     session["state"] = "main"
@@ -486,258 +2487,1163 @@ def handle_month_selection(to, session, list_id):
 
 # ==================== MENUS ====================
 def ask_language(to):
-    send_buttons(to, "Welcome to GAJA!\n\nGAJA-விற்கு வரவேற்கிறோம்!\n\nPlease select your language / உங்கள் மொழியைத் தேர்ந்தெடுக்கவும்", [
-        {"id": "lang_en", "title": "English"},
-        {"id": "lang_ta", "title": "தமிழ்"}
-    ])
+    send_template("ask_language", None, to)
 
 def main_menu(to, lang):
-    body = "Welcome! How can we help you today?" if lang == "en" else "வணக்கம்! எப்படி உதவலாம்?"
-    send_buttons(to, body, [
-        {"id": "main_customer", "title": "Customer" if lang=="en" else "வாடிக்கையாளர்"},
-        {"id": "main_carpenter", "title": "Carpenter" if lang=="en" else "கார்பென்டர்"},
-        {"id": "main_talk", "title": "Talk to Us" if lang=="en" else "பேச வேண்டுமா?"}
-    ])
+    send_template("main_menu", lang, to)
 
 def customer_menu(to, lang):
-    send_buttons(to, "Customer Menu" if lang=="en" else "வாடிக்கையாளர் மெனு", [
-        {"id": "cust_catalog", "title": "View Catalogue" if lang=="en" else "கேட்டலாக் பார்க்க"},
-        {"id": "back_to_main", "title": "Back to Main" if lang=="en" else "முகப்புக்கு"}
-    ])
+    send_template("customer_menu", lang, to)
 
 def carpenter_menu(to, lang):
-    footer = "\n\nType 0 or 'menu' anytime to go back" if lang=="en" else "\n\nஎப்போது வேண்டுமானாலும் 0 அல்லது 'menu' என தட்டச்சு செய்து முகப்புக்கு செல்லலாம்"
-    send_buttons(to, ("Carpenter Menu" if lang=="en" else "கார்பென்டர் மெனு") + footer, [
-        {"id": "carp_register", "title": "Register" if lang=="en" else "பதிவு"},
-        {"id": "carp_scheme", "title": "Scheme Info" if lang=="en" else "ஸ்கீம்"},
-        {"id": "carp_cashback", "title": "Check Cashback" if lang=="en" else "கேஷ்பேக்"}
-    ])
+    send_template("carpenter_menu", lang, to)
+
+def build_templates():
+    """Menus and fixed texts for every language, encoded once; {{x}} marks a per-send value"""
+    t = TemplateRegistry()
+    to = "{{to}}"
+    t.add("ask_language", None, buttons_payload(to, "Welcome to GAJA!\n\nGAJA-விற்கு வரவேற்கிறோம்!\n\nPlease select your language / உங்கள் மொழியைத் தேர்ந்தெடுக்கவும்", [
+        {"id": "lang_en", "title": "English"},
+        {"id": "lang_ta", "title": "தமிழ்"}
+    ]))
+    t.add("warranty_tc", None, text_payload(to, WARRANTY_TC.format(phone=GAJA_PHONE)))
+    t.add("slow_down", None, text_payload(to, (
+        "⏳ You're sending messages too quickly. Please wait a minute and try again.\n\n"
+        "⏳ நீங்கள் மிக வேகமாக செய்திகளை அனுப்புகிறீர்கள். ஒரு நிமிடம் காத்திருந்து மீண்டும் முயற்சிக்கவும்."
+    )))
+    for lang in ("en", "ta"):
+        en = lang == "en"
+        t.add("main_menu", lang, buttons_payload(to, "Welcome! How can we help you today?" if en else "வணக்கம்! எப்படி உதவலாம்?", [
+            {"id": "main_customer", "title": "Customer" if en else "வாடிக்கையாளர்"},
+            {"id": "main_carpenter", "title": "Carpenter" if en else "கார்பென்டர்"},
+            {"id": "main_talk", "title": "Talk to Us" if en else "பேச வேண்டுமா?"}
+        ]))
+        t.add("customer_menu", lang, buttons_payload(to, "Customer Menu" if en else "வாடிக்கையாளர் மெனு", [
+            {"id": "cust_catalog", "title": "View Catalogue" if en else "கேட்டலாக் பார்க்க"},
+            {"id": "back_to_main", "title": "Back to Main" if en else "முகப்புக்கு"}
+        ]))
+        footer = "\n\nType 0 or 'menu' anytime to go back" if en else "\n\nஎப்போது வேண்டுமானாலும் 0 அல்லது 'menu' என தட்டச்சு செய்து முகப்புக்கு செல்லலாம்"
+        t.add("carpenter_menu", lang, buttons_payload(to, ("Carpenter Menu" if en else "கார்பென்டர் மெனு") + footer, [
+            {"id": "carp_register", "title": "Register" if en else "பதிவு"},
+            {"id": "carp_scheme", "title": "Scheme Info" if en else "ஸ்கீம்"},
+            {"id": "carp_cashback", "title": "Check Cashback" if en else "கேஷ்பேக்"}
+        ]))
+        t.add("anything_else", lang, buttons_payload(to, "Anything else?" if en else "வேறு ஏதாவது?", [
+            {"id": "warr_close", "title": "✖️ Close" if en else "✖️ மூடு"}
+        ]))
+        t.add("warranty_learn_more", lang, buttons_payload(to, "Learn more:" if en else "மேலும் அறிய:", [
+            {"id": "warr_care", "title": "🛠️ Care Tips" if en else "🛠️ பராமரிப்பு"},
+            {"id": "warr_tc", "title": "📋 Terms" if en else "📋 விதிமுறைகள்"},
+            {"id": "warr_close", "title": "✖️ Close" if en else "✖️ மூடு"}
+        ]))
+        t.add("warranty_confirmation", lang, text_payload(to, (
+            "🎉 *WARRANTY REGISTERED!*\n"
+            "━━━━━━━━━━━━━━━━━━━━━\n\n"
+            "📦 *Product:* {{sku_name}}\n"
+            "🏷️ *Category:* {{category}}\n"
+            "⏰ *Warranty:* {{warranty_months}} months\n\n"
+            "✅ Your warranty is now active!"
+        ) if en else (  # Tamil fallback
+            "🎉 *வாரன்டி பதிவு செய்யப்பட்டது!*\n"
+            "━━━━━━━━━━━━━━━━━━━━━\n\n"
+            "📦 *பொருள்:* {{sku_name}}\n"
+            "🏷️ *வகை:* {{category}}\n"
+            "⏰ *வாரன்டி:* {{warranty_months}} மாதங்கள்\n\n"
+            "✅ உங்கள் வாரன்டி செயலில் உள்ளது!"
+        )))
+        t.add("warranty_accepted", lang, text_payload(to, (
+            "🎉 *WARRANTY REGISTERED!*\n"
+            "━━━━━━━━━━━━━━━━━━━━━\n\n"
+            "📦 *Product:* {{sku_name}}\n"
+            "🏷️ *Category:* {{category}}\n\n"
+            "✅ Your warranty is now active!"
+        ) if en else (
+            "🎉 *வாரன்டி பதிவு செய்யப்பட்டது!*\n"
+            "━━━━━━━━━━━━━━━━━━━━━\n\n"
+            "📦 *பொருள்:* {{sku_name}}\n"
+            "🏷️ *வகை:* {{category}}\n\n"
+            "✅ உங்கள் வாரன்டி செயலில் உள்ளது!"
+        )))
+        t.add("warranty_rejected", lang, text_payload(to, (
+            "⚠️ *Warranty registration could not be completed*\n\n"
+            "Token {{token}} was not accepted by our system.\n\n"
+            f"Please call {GAJA_PHONE} and we will sort it out."
+        ) if en else (
+            "⚠️ *வாரன்டி பதிவு முடிக்க முடியவில்லை*\n\n"
+            "டோக்கன் {{token}} எங்கள் அமைப்பில் ஏற்கப்படவில்லை.\n\n"
+            f"{GAJA_PHONE} அழைக்கவும், நாங்கள் சரிசெய்கிறோம்."
+        )))
+        t.add("care_instructions", lang, text_payload(to, (
+            "🛠️ *CARE INSTRUCTIONS*\n"
+            "{{category}}\n\n"
+            "{{care}}\n\n"
+            "Follow these tips to maximize your product's lifespan!"
+        ) if en else (
+            "🛠️ *பராமரிப்பு வழிமுறைகள்*\n"
+            "{{category}}\n\n"
+            "{{care}}\n\n"
+            "உங்கள் பொருளின் ஆயுளை அதிகரிக்க இந்த குறிப்புகளைப் பின்பற்றவும்!"
+        )))
+        t.add("ask_barcode", lang, text_payload(to, (
+            "✅ Warranty token verified!\n\n"
+            "📦 Next step: Enter the 6-digit code from your product's MRP sticker.\n\n"
+            "Example: 528941\n\n"
+            "Please type the 6-digit code:"
+        ) if en else (
+            "✅ வாரன்டி டோக்கன் சரிபார்க்கப்பட்டது!\n\n"
+            "📦 அடுத்தது: உங்கள் பொருளின் MRP ஸ்டிக்கரில் உள்ள 6-இலக்க குறியீட்டை உள்ளிடவும்.\n\n"
+            "உதாரணம்: 528941\n\n"
+            "6-இலக்க குறியீட்டை தட்டச்சு செய்யவும்:"
+        )))
+        t.add("ask_carpenter_code", lang, text_payload(to, ("Please enter your Carpenter Code (e.g. ABC123)" if en else "உங்கள் கார்பென்டர் கோடை உள்ளிடவும் (எ.கா. ABC123)") + "\n\nType 0 to go back"))
+        t.add("cashback_result", lang, text_payload(to,
+            f"Hello {{{{name}}}}!\n\nCashback for {{{{month}}}}: ₹{{{{amount}}}}\n\nTransferred by month end.\nCall {GAJA_PHONE} for queries." if en else
+            f"வணக்கம் {{{{name}}}}!\n\n{{{{month}}}} கேஷ்பேக்: ₹{{{{amount}}}}\n\nமாத இறுதிக்குள் வரவு வைக்கப்படும்.\n{GAJA_PHONE} அழைக்கவும்."))
+        statuses = {
+            "status_verifying": ("⏳ Verifying your warranty token...", "⏳ உங்கள் வாரன்டி டோக்கனை சரிபார்க்கிறது..."),
+            "status_looking_up": ("⏳ Looking up your product...", "⏳ உங்கள் பொருளைத் தேடுகிறது..."),
+            "status_registering": ("⏳ Registering your warranty...", "⏳ உங்கள் வாரன்டியை பதிவு செய்கிறது..."),
+            "status_checking_months": ("⏳ Checking available months...", "⏳ மாதங்கள் சரிபார்க்கப்படுகிறது..."),
+            "status_fetching_cashback": ("⏳ Fetching your cashback details...", "⏳ உங்கள் கேஷ்பேக் விவரங்கள் பெறப்படுகிறது..."),
+            "status_sending_catalogue": ("📄 Sending catalogue...", "📄 கேட்டலாக் அனுப்பப்படுகிறது..."),
+            "status_catalogue_sent": ("✅ Catalogue sent successfully!", "✅ கேட்டலாக் வெற்றிகரமாக அனுப்பப்பட்டது!"),
+            "status_sending_scheme": ("📸 Sending scheme details...", "📸 ஸ்கீம் விவரங்கள் அனுப்பப்படுகிறது..."),
+            "status_scheme_sent": ("✅ Scheme details sent!", "✅ ஸ்கீம் விவரங்கள் அனுப்பப்பட்டது!"),
+            "talk_to_us": ("Thank you! We'll call you soon.", "நன்றி! விரைவில் அழைக்கிறோம்."),
+            "goodbye": ("Thank you for choosing GAJA! 🙏", "GAJA-வை தேர்ந்தெடுத்ததற்கு நன்றி! 🙏"),
+            "session_ended": (
+                "👋 Session ended. Thank you for contacting GAJA!\n\nType 'hi' anytime to restart.",
+                "👋 உரையாடல் முடிந்தது. GAJA-வை தொடர்பு கொண்டதற்கு நன்றி!\n\nமீண்டும் தொடங்க 'hi' என தட்டச்சு செய்யவும்."
+            ),
+            "fallback": ("I didn't understand that. 🤔\n\nHere's the main menu:", "புரியவில்லை. 🤔\n\nஇதோ முகப்பு மெனு:"),
+        }
+        for name, (en_text, ta_text) in statuses.items():
+            t.add(name, lang, text_payload(to, en_text if en else ta_text))
+    return t
+
+templates = build_templates()
+
+# ==================== CONVERSATION FLOW (STATE MACHINE) ====================
+ANY = "*"
+STATES = ("start", "main", "awaiting_code", "awaiting_month", "awaiting_barcode", "warranty_complete")
+
+class StateMachine:
+    """Table-driven router for inbound messages.
+
+    Handlers are registered per (state, trigger kind, trigger) in one dict, so routing a
+    message is a handful of O(1) lookups instead of walking an if/elif chain. A message is
+    turned into candidate triggers in priority order (e.g. a text is token > keyword >
+    free text); for each, the exact state is tried before the ANY state, and ANY as the
+    trigger acts as that kind's default. The "start" state (no language chosen yet) only
+    matches its own entries, so global keywords and buttons do not leak into it.
+    """
+
+    def __init__(self):
+        self.table = {}  # (state, kind, trigger) -> handler(frm, session, arg)
+        self.latency = {}  # "state:handler" -> [count, total_ms, max_ms]
+        self.lock = Lock()
+
+    def on(self, kind, *triggers, states=(ANY,)):
+        unknown = set(states) - set(STATES) - {ANY}
+        if unknown:
+            raise ValueError(f"Unknown states: {sorted(unknown)}")
+
+        def register(handler):
+            for state in states:
+                for trigger in triggers or (ANY,):
+                    self.table[(state, kind, trigger)] = handler
+            return handler
+        return register
+
+    @staticmethod
+    def triggers(msg):
+        """Candidate (kind, trigger, arg) tuples for a message, highest priority first"""
+        mtype = msg.get("type")
+        interactive = msg.get("interactive") or {}
+        if mtype == "interactive" and "button_reply" in interactive:
+            btn = interactive["button_reply"]["id"]
+            return [("button", btn, btn), ("button", ANY, btn)]
+        if mtype == "interactive" and interactive.get("type") == "list_reply":
+            list_id = interactive["list_reply"]["id"]
+            return [("list", list_id, list_id), ("list", ANY, list_id)]
+        if mtype == "text":
+            text_raw = msg["text"]["body"]
+            candidates = []
+            token = detect_warranty_token(text_raw)
+            if token:
+                candidates.append(("token", ANY, token))
+            candidates += [("keyword", text_raw.strip().lower(), text_raw), ("text", ANY, text_raw)]
+            return candidates
+        return [(mtype, ANY, None)]
+
+    def resolve(self, state, candidates):
+        scopes = (state,) if state == "start" else (state, ANY)
+        for kind, trigger, arg in candidates + [(ANY, ANY, None)]:
+            for scope in scopes:
+                handler = self.table.get((scope, kind, trigger))
+                if handler:
+                    return handler, arg
+        return None, None
+
+    def dispatch(self, msg):
+        frm = msg["from"]
+        s = get_session(frm)
+        state = "start" if s.get("lang") is None else s.get("state")
+        log_event("inbound", frm=frm, type=msg["type"], state=s.get("state"), lang=s.get("lang"))
+        handler, arg = self.resolve(state, self.triggers(msg))
+        if handler is None:
+            return
+        started = time.perf_counter()
+        try:
+            handler(frm, s, arg)
+        finally:
+            self._record(f"{state}:{handler.__name__}", (time.perf_counter() - started) * 1000)
+
+    def _record(self, key, ms):
+        with self.lock:
+            entry = self.latency.setdefault(key, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += ms
+            entry[2] = max(entry[2], ms)
+
+    def stats(self):
+        with self.lock:
+            return {key: {"count": n, "avg_ms": round(total / n, 2), "max_ms": round(peak, 2)}
+                    for key, (n, total, peak) in self.latency.items()}
+
+flow = StateMachine()
+
+def handle_message(msg):
+    """Run the conversation turn for one inbound message"""
+    flow.dispatch(msg)
+
+# ---- start: no language chosen yet ----
+@flow.on("button", "lang_en", "lang_ta", states=("start",))
+def on_language_selected(frm, s, btn):
+    s["lang"] = "en" if btn == "lang_en" else "ta"
+    s["state"] = "main"
+    save_session(frm, s)
+    main_menu(frm, s["lang"])
+
+@flow.on(ANY, states=("start",))
+def on_start(frm, s, arg):
+    # Not language selection or warranty token -> show language menu
+    ask_language(frm)
+
+# ---- warranty token (any state, including start) ----
+@flow.on("token", states=("start", ANY))
+def on_warranty_token(frm, s, token):
+    handle_warranty_start(frm, s, token)
+
+# ---- buttons ----
+@flow.on("button", "main_customer")
+def on_main_customer(frm, s, btn):
+    s["state"] = "main"
+    save_session(frm, s)
+    customer_menu(frm, s["lang"])
+
+@flow.on("button", "main_carpenter")
+def on_main_carpenter(frm, s, btn):
+    s["state"] = "main"
+    save_session(frm, s)
+    carpenter_menu(frm, s["lang"])
+
+@flow.on("button", "main_talk")
+def on_main_talk(frm, s, btn):
+    send_template("talk_to_us", s["lang"], frm)
+    main_menu(frm, s["lang"])
+
+@flow.on("button", "cust_catalog")
+def on_catalogue(frm, s, btn):
+    if CATALOG_URL:
+        send_template("status_sending_catalogue", s["lang"], frm)
+        send_document(frm, CATALOG_URL, caption="Latest GAJA Catalogue", filename=CATALOG_FILENAME)
+        send_template("status_catalogue_sent", s["lang"], frm)
+    else:
+        error = f"❌ Catalogue temporarily unavailable.\nPlease call {GAJA_PHONE}" if s["lang"]=="en" else f"❌ கேட்டலாக் தற்காலிகமாக கிடைக்கவில்லை.\nதயவுசெய்து {GAJA_PHONE} அழைக்கவும்"
+        send_text(frm, error)
+    customer_menu(frm, s["lang"])
+
+@flow.on("button", "back_to_main", "cust_back")
+def on_back_to_main(frm, s, btn):
+    s["state"] = "main"
+    save_session(frm, s)
+    main_menu(frm, s["lang"])
+
+@flow.on("button", "carp_register")
+def on_carpenter_register(frm, s, btn):
+    reg_msg = (
+        f"📝 *Carpenter Registration*\n\n"
+        f"To register as a GAJA Carpenter, please contact:\n\n"
+        f"📞 GAJA Service: {GAJA_SERVICE}\n\n"
+        f"Our team will assist you with the registration process!"
+    ) if s["lang"]=="en" else (
+        f"📝 *கார்பென்டர் பதிவு*\n\n"
+        f"GAJA கார்பென்டராக பதிவு செய்ய, தொடர்பு கொள்ளவும்:\n\n"
+        f"📞 GAJA சேவை: {GAJA_SERVICE}\n\n"
+        f"எங்கள் குழு உங்களுக்கு பதிவு செயல்முறையில் உதவும்!"
+    )
+    send_text(frm, reg_msg)
+    carpenter_menu(frm, s["lang"])
+
+@flow.on("button", "carp_cashback")
+def on_carpenter_cashback(frm, s, btn):
+    s["state"] = "awaiting_code"
+    save_session(frm, s)
+    ask_carpenter_code(frm, s["lang"])
+
+@flow.on("button", "carp_scheme")
+def on_carpenter_scheme(frm, s, btn):
+    if SCHEME_IMAGES:
+        send_template("status_sending_scheme", s["lang"], frm)
+        for url in SCHEME_IMAGES[:5]:
+            send_image(frm, url)
+        send_template("status_scheme_sent", s["lang"], frm)
+    else:
+        error = f"❌ Scheme images unavailable.\nPlease call {GAJA_PHONE}" if s["lang"]=="en" else f"❌ ஸ்கீம் படங்கள் கிடைக்கவில்லை.\nதயவுசெய்து {GAJA_PHONE} அழைக்கவும்"
+        send_text(frm, error)
+    carpenter_menu(frm, s["lang"])
+
+# Warranty-related buttons (from KISS flow)
+@flow.on("button", "warr_care")
+def on_warranty_care(frm, s, btn):
+    if s.get("warranty_product"):
+        send_care_instructions(frm, s["lang"], s["warranty_product"])
+    else:
+        send_text(frm, "No product info available." if s.get("lang") == "en" else "பொருள் தகவல் இல்லை.")
+
+@flow.on("button", "warr_tc")
+def on_warranty_tc(frm, s, btn):
+    send_warranty_tc(frm, s["lang"])
+
+@flow.on("button", "warr_close")
+def on_warranty_close(frm, s, btn):
+    send_template("goodbye", s.get("lang"), frm)
+    end_session(frm)
+
+# ---- list replies ----
+@flow.on("list", states=("awaiting_month",))
+def on_month_selected(frm, s, list_id):
+    handle_month_selection(frm, s, list_id)
+
+# ---- text: keywords first, then the state's free-text input, then fallback ----
+@flow.on("keyword", "exit", "close", "quit", "bye", "stop")
+def on_end_session(frm, s, text_raw):
+    end_session(frm)
+    send_template("session_ended", s.get("lang"), frm)
+    logger.info(f"SESSION ENDED by user: {frm}")
+
+@flow.on("keyword", "0", "menu", "back", "main", "home")
+def on_menu(frm, s, text_raw):
+    s["state"] = "main"
+    save_session(frm, s)
+    main_menu(frm, s["lang"])
+
+@flow.on("keyword", "hi", "hello", "start")
+def on_restart(frm, s, text_raw):
+    save_session(frm, Session())
+    ask_language(frm)
+
+@flow.on("text", states=("awaiting_barcode",))
+def on_barcode_text(frm, s, text_raw):
+    handle_barcode_input(frm, s, text_raw)
+
+@flow.on("text", states=("awaiting_code",))
+def on_carpenter_code_text(frm, s, text_raw):
+    handle_carpenter_code(frm, s, text_raw)
+
+@flow.on("text")
+def on_unrecognised_text(frm, s, text_raw):
+    send_template("fallback", s["lang"], frm)
+    main_menu(frm, s["lang"])
+
+# ==================== CAMPAIGNS (broadcast) ====================
+class CampaignError(ValueError):
+    pass
+
+class CampaignSender:
+    """Broadcasts (new schemes, catalogue updates) to opted-in recipients, resumable across restarts.
+
+    A campaign is a message list, optionally per language, and one SQLite row per recipient.
+    The messages are encoded once as MessageTemplates (media uploaded once, sent by ID). A
+    dispatcher queues pending recipients a few at a time and CAMPAIGN_WORKERS threads
+    deliver each recipient's messages in order, marking the row 'sending' as they start. Every message takes
+    a token from the same PHONE_NUMBER_ID bucket as conversational replies, but a broadcast
+    never takes the last CAMPAIGN_RESERVE of it, so users chatting with the bot are not
+    starved. Throttled sends pause the bucket and are retried like OutboundScheduler does.
+
+    Progress (including how many of a recipient's messages went out) is checkpointed every
+    CAMPAIGN_CHECKPOINT_INTERVAL, and on SIGTERM. After a crash, a recipient still marked
+    'sending' may already have the message, so it becomes 'unknown' instead of being sent
+    twice. Free-form messages only reach users who wrote to us in the last 24 hours; for
+    everyone else use an approved WhatsApp template ({"template": name, ...}).
+    """
+
+    STATUSES = ("pending", "sending", "sent", "failed", "unknown")
+
+    def __init__(self, path, workers, bucket, reserve):
+        self.workers = workers
+        self.bucket = bucket
+        self.reserve = reserve
+        self.cond = Condition()
+        self.work = deque()  # (campaign_id, phone, lang, progress) queued for the workers, still 'pending' in the db
+        self.in_flight = 0
+        self.results = []  # checkpoint rows waiting to be written
+        self.compiled = {}  # campaign_id -> {lang: [[payload dict, MessageTemplate], ...]}
+        self.live = {}  # campaign_id -> {"messages": n, "failed": n, "throttled": n, "sent_at": deque}
+        self.stopping = False
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # a 'sending' mark per recipient; durable across a process crash
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS campaigns (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+            "messages TEXT NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL, started_at REAL, finished_at REAL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS campaign_recipients (campaign_id INTEGER NOT NULL, phone TEXT NOT NULL, "
+            "lang TEXT, status TEXT NOT NULL, progress INTEGER NOT NULL DEFAULT 0, throttled INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, updated_at REAL, PRIMARY KEY (campaign_id, phone))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS campaign_recipients_status ON campaign_recipients (campaign_id, status)")
+        unknown = self.db.execute("UPDATE campaign_recipients SET status = 'unknown', error = 'interrupted while sending' "
+                                  "WHERE status = 'sending'").rowcount
+        if unknown:
+            logger.warning(f"CAMPAIGNS: {unknown} recipients were mid-send at the last shutdown, marked unknown (not resent)")
+
+    # ---- building ----
+    @staticmethod
+    def normalise_phone(phone):
+        digits = re.sub(r"[\s+()-]", "", str(phone))
+        return digits if digits.isdigit() and 8 <= len(digits) <= 15 else None
+
+    @staticmethod
+    def message_payload(spec, wait=True):
+        """The Graph payload (to = {{to}}) of one message spec; a spec may expand to several.
+
+        Without wait, media not uploaded yet is referenced by link instead of blocking on the upload.
+        """
+        to = "{{to}}"
+        if not isinstance(spec, dict):
+            raise CampaignError(f"message must be an object: {spec!r}")
+        if "template" in spec:
+            template = {"name": spec["template"], "language": {"code": spec.get("language", "en")}}
+            if spec.get("components"):
+                template["components"] = spec["components"]
+            return [{"messaging_product": "whatsapp", "to": to, "type": "template", "template": template}]
+        if "text" in spec:
+            return [text_payload(to, spec["text"])]
+        if "image" in spec:
+            return [image_payload(to, spec["image"], spec.get("caption"), wait=wait)]
+        if "document" in spec:
+            return [document_payload(to, spec["document"], spec.get("caption"), spec.get("filename"), wait=wait)]
+        if spec.get("scheme_images"):
+            if not SCHEME_IMAGES:
+                raise CampaignError("scheme_images requested but no SCHEME_IMG* is configured")
+            return [image_payload(to, url, wait=wait) for url in SCHEME_IMAGES[:5]]
+        if spec.get("catalogue"):
+            if not CATALOG_URL:
+                raise CampaignError("catalogue requested but CATALOG_URL is not configured")
+            return [document_payload(to, CATALOG_URL, spec.get("caption"), CATALOG_FILENAME, wait=wait)]
+        raise CampaignError(f"unknown message kind: {sorted(spec)}")
+
+    @staticmethod
+    def template(payload):
+        # only "to" is filled in: braces in the campaign's own text are sent as written
+        return MessageTemplate(payload, slots=("to",))
+
+    def compile(self, messages, wait=True):
+        """{lang: [[payload, MessageTemplate], ...]} for a campaign's messages (a list, or a dict per language)"""
+        per_lang = messages if isinstance(messages, dict) else {"en": messages, "ta": messages}
+        compiled = {}
+        for lang, specs in per_lang.items():
+            if not isinstance(specs, list) or not specs:
+                raise CampaignError(f"messages for {lang!r} must be a non-empty list")
+            compiled[lang] = [[payload, self.template(payload)]
+                              for spec in specs for payload in self.message_payload(spec, wait)]
+        return compiled
+
+    def create(self, name, recipients, messages):
+        """Store and start a campaign; returns its report. Duplicate and malformed numbers are skipped."""
+        if not isinstance(recipients, list) or not recipients:
+            raise CampaignError("recipients must be a non-empty list")
+        if len(recipients) > CAMPAIGN_MAX_RECIPIENTS:
+            raise CampaignError(f"at most {CAMPAIGN_MAX_RECIPIENTS} recipients per campaign")
+        compiled = self.compile(messages, wait=False)  # validation only: the workers compile with media uploaded
+        rows, skipped = {}, 0
+        for r in recipients:
+            phone = self.normalise_phone(r.get("phone") if isinstance(r, dict) else r)
+            lang = r.get("lang") if isinstance(r, dict) else None
+            if phone is None:
+                skipped += 1
+                continue
+            rows.setdefault(phone, lang if lang in compiled else next(iter(compiled)))
+        now = time.time()
+        with self.cond:
+            self.db.execute("BEGIN")
+            campaign_id = self.db.execute(
+                "INSERT INTO campaigns (name, messages, status, created_at, started_at) VALUES (?, ?, 'running', ?, ?)",
+                (str(name or "campaign")[:100], json.dumps(messages), now, now)).lastrowid
+            self.db.executemany(
+                "INSERT INTO campaign_recipients (campaign_id, phone, lang, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                [(campaign_id, phone, lang, now) for phone, lang in rows.items()])
+            self.db.execute("COMMIT")
+            self.cond.notify_all()
+        logger.info(f"CAMPAIGN {campaign_id} CREATED: {name} | {len(rows)} recipients | {skipped} skipped")
+        pumble.notify(f"CAMPAIGN {campaign_id} STARTED | {name} | {len(rows)} recipients")
+        return dict(self.report(campaign_id), skipped=skipped, duplicates=len(recipients) - skipped - len(rows))
+
+    def set_status(self, campaign_id, status):
+        """Pause, resume or cancel; returns the report, or None for an unknown or finished campaign"""
+        allowed = {"paused": ("running",), "running": ("paused",), "cancelled": ("running", "paused")}[status]
+        with self.cond:
+            row = self.db.execute("SELECT status FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+            if row is None or row[0] not in allowed:
+                return None
+            self.db.execute("UPDATE campaigns SET status = ?, finished_at = ? WHERE id = ?",
+                            (status, time.time() if status == "cancelled" else None, campaign_id))
+            self.cond.notify_all()
+        logger.info(f"CAMPAIGN {campaign_id} {status.upper()}")
+        return self.report(campaign_id)
+
+    # ---- sending ----
+    def _campaign_status(self, campaign_id):
+        row = self.db.execute("SELECT status FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+        return row[0] if row else None
+
+    def _compiled(self, campaign_id):
+        """The campaign's compiled messages; the first call uploads its media, so never call it holding cond"""
+        compiled = self.compiled.get(campaign_id)
+        if compiled is None:
+            with self.cond:
+                (messages,) = self.db.execute("SELECT messages FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+            compiled = self.compile(json.loads(messages))
+            with self.cond:
+                compiled = self.compiled.setdefault(campaign_id, compiled)  # a racing worker's copy wins if it was first
+        return compiled
+
+    def _claim(self, limit):
+        """Up to `limit` pending recipients of running campaigns not already queued (caller holds cond)"""
+        queued = {(cid, phone) for cid, phone, _, _ in self.work}
+        rows = self.db.execute(
+            "SELECT r.campaign_id, r.phone, r.lang, r.progress FROM campaign_recipients r "
+            "JOIN campaigns c ON c.id = r.campaign_id WHERE c.status = 'running' AND r.status = 'pending' "
+            "ORDER BY r.campaign_id LIMIT ?", (limit + len(queued),)).fetchall()
+        return [row for row in rows if (row[0], row[1]) not in queued][:limit]
+
+    def _finish_done(self):
+        """Close running campaigns with nothing left to send (caller holds cond, results checkpointed)"""
+        done = self.db.execute(
+            "SELECT id, name FROM campaigns c WHERE status = 'running' AND NOT EXISTS ("
+            "SELECT 1 FROM campaign_recipients r WHERE r.campaign_id = c.id AND r.status IN ('pending', 'sending'))").fetchall()
+        for campaign_id, name in done:
+            self.db.execute("UPDATE campaigns SET status = 'done', finished_at = ? WHERE id = ?", (time.time(), campaign_id))
+            self.compiled.pop(campaign_id, None)
+        return done
+
+    def _checkpoint(self):
+        """Write buffered recipient results (caller holds cond)"""
+        if not self.results:
+            return
+        self.db.execute("BEGIN")
+        self.db.executemany("UPDATE campaign_recipients SET status = ?, progress = ?, throttled = throttled + ?, "
+                            "error = ?, updated_at = ? WHERE campaign_id = ? AND phone = ?", self.results)
+        self.db.execute("COMMIT")
+        self.results = []
+
+    def _dispatcher(self):
+        last_checkpoint = time.time()
+        while True:
+            with self.cond:
+                self.cond.wait(CAMPAIGN_CHECKPOINT_INTERVAL)
+                if self.stopping:
+                    return
+                idle = not self.work and not self.in_flight
+                if idle or time.time() - last_checkpoint >= CAMPAIGN_CHECKPOINT_INTERVAL:
+                    self._checkpoint()
+                    last_checkpoint = time.time()
+                if len(self.work) < self.workers:
+                    self.work.extend(self._claim(2 * self.workers - len(self.work)))
+                    self.cond.notify_all()
+                done = self._finish_done() if idle and not self.work else []
+            for campaign_id, name in done:
+                report = self.report(campaign_id)
+                logger.info(f"CAMPAIGN {campaign_id} DONE: {report['recipients']} | {report['messages_per_s']} msg/s")
+                pumble.notify(f"CAMPAIGN {campaign_id} DONE | {name} | {report['recipients']}")
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.work or self.stopping:
+                    self.cond.wait()
+                campaign_id, phone, lang, progress = self.work.popleft()
+                if self._campaign_status(campaign_id) != "running":
+                    continue  # paused or cancelled while queued; the row is still pending
+                # from here on a crash leaves the recipient 'unknown' rather than sending twice
+                self.db.execute("UPDATE campaign_recipients SET status = 'sending' WHERE campaign_id = ? AND phone = ?",
+                                (campaign_id, phone))
+                self.in_flight += 1
+            try:
+                result = self._send_recipient(campaign_id, phone, lang, progress)
+            except Exception as e:
+                logger.exception(f"CAMPAIGN {campaign_id} SEND ERROR: {e}")
+                result = ("failed", progress, 0, str(e)[:200])
+            with self.cond:
+                self.in_flight -= 1
+                self.results.append(result + (time.time(), campaign_id, phone))
+                if len(self.work) < self.workers:
+                    self.cond.notify_all()  # wake the dispatcher to top the queue up
+
+    def _send_recipient(self, campaign_id, phone, lang, progress):
+        """Send the recipient's remaining messages; returns (status, progress, throttled, error)"""
+        with self.cond:
+            status = self._campaign_status(campaign_id)
+            live = self.live.setdefault(campaign_id, {"messages": 0, "failed": 0, "throttled": 0,
+                                                      "sent_at": deque(maxlen=2000)})
+        if status != "running":
+            return "pending", progress, 0, None  # paused or cancelled after it was claimed
+        messages = self._compiled(campaign_id).get(lang)
+        throttled = 0
+        while progress < len(messages):
+            entry = messages[progress]
+            for attempt in range(GRAPH_MAX_RETRIES + 1):
+                self.bucket.acquire(self.reserve)
+                code, body = deliver(entry[1].render(to=phone))
+                if code != 200 and media.is_media_error(body):
+                    repaired = media.repair(entry[0], wait=True)
+                    if repaired is not None:
+                        entry[0], entry[1] = repaired, self.template(repaired)
+                        code, body = deliver(entry[1].render(to=phone))
+                if not is_throttled(code, body):
+                    break
+                throttled += 1
+                with self.cond:
+                    live["throttled"] += 1
+                self.bucket.pause(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
+            if code != 200:
+                with self.cond:
+                    live["failed"] += 1
+                error = (body.get("error") or {}) if isinstance(body, dict) else {}
+                if isinstance(error, dict):
+                    error = f"{error.get('code')}: {error.get('message')}"
+                return "failed", progress, throttled, f"{code} {error}"[:200]
+            progress += 1
+            with self.cond:
+                live["messages"] += 1
+                live["sent_at"].append(time.time())
+        return "sent", progress, throttled, None
+
+    def start(self):
+        if self.workers <= 0:
+            return
+        Thread(target=self._dispatcher, name="campaign-dispatcher", daemon=True).start()
+        for i in range(self.workers):
+            Thread(target=self._worker, name=f"campaign-{i}", daemon=True).start()
+
+    def stop(self, timeout):
+        """Stop claiming, drop the queue (still pending in the db), wait for in-flight sends and checkpoint"""
+        deadline = time.time() + timeout
+        with self.cond:
+            self.stopping = True
+            self.work.clear()
+            self.cond.notify_all()
+            while self.in_flight and time.time() < deadline:
+                self.cond.wait(0.1)
+            self._checkpoint()
+            return not self.in_flight
+
+    # ---- reporting ----
+    def report(self, campaign_id):
+        with self.cond:
+            row = self.db.execute("SELECT name, status, created_at, started_at, finished_at FROM campaigns WHERE id = ?",
+                                  (campaign_id,)).fetchone()
+            if row is None:
+                return None
+            name, status, created_at, started_at, finished_at = row
+            counts = dict.fromkeys(self.STATUSES, 0)
+            counts.update(self.db.execute("SELECT status, COUNT(*) FROM campaign_recipients WHERE campaign_id = ? "
+                                          "GROUP BY status", (campaign_id,)).fetchall())
+            messages, throttled = self.db.execute(
+                "SELECT COALESCE(SUM(progress), 0), COALESCE(SUM(throttled), 0) FROM campaign_recipients "
+                "WHERE campaign_id = ?", (campaign_id,)).fetchone()
+            live = self.live.get(campaign_id)
+            recent = [t for t in live["sent_at"] if t > time.time() - 10] if live else []
+        elapsed = (finished_at or time.time()) - started_at
+        # rows of recipients still in the work queue or in flight are not checkpointed yet
+        messages = max(messages, live["messages"]) if live else messages
+        return {"id": campaign_id, "name": name, "status": status, "recipients": counts,
+                "messages_sent": messages, "throttled": max(throttled, live["throttled"] if live else 0),
+                "elapsed_s": round(elapsed, 1), "messages_per_s": round(messages / elapsed, 2) if elapsed > 0 else 0,
+                "recent_messages_per_s": round(len(recent) / 10, 2), "created_at": created_at, "finished_at": finished_at}
+
+    def reports(self):
+        with self.cond:
+            ids = [r[0] for r in self.db.execute("SELECT id FROM campaigns ORDER BY id DESC LIMIT 50")]
+        return [self.report(campaign_id) for campaign_id in ids]
+
+    def stats(self):
+        with self.cond:
+            running = self.db.execute("SELECT COUNT(*) FROM campaigns WHERE status = 'running'").fetchone()[0]
+            return {"running": running, "queued": len(self.work), "in_flight": self.in_flight, "workers": self.workers,
+                    "messages": sum(l["messages"] for l in self.live.values()),
+                    "failed": sum(l["failed"] for l in self.live.values()),
+                    "throttled": sum(l["throttled"] for l in self.live.values())}
+
+campaigns = CampaignSender(JOB_DB_PATH, CAMPAIGN_WORKERS, outbound.bucket, CAMPAIGN_RESERVE)
+campaigns.start()
+
+# ==================== ADMISSION CONTROL ====================
+class AdmissionControl:
+    """Token buckets per sender and for the whole bot, checked before a message becomes a job.
+
+    Messages that will turn into Apps Script calls (a "GAJA ..." token, a 6-digit barcode)
+    cost LOOKUP_COST tokens, everything else one. A message is admitted only if both the
+    sender's bucket and the global bucket can pay; otherwise it is shed and the sender gets
+    at most one "slow down" reply per THROTTLE_NOTICE_INTERVAL.
+    """
+
+    def __init__(self, sender_rate, sender_burst, global_rate, global_burst, max_senders):
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.max_senders = max_senders
+        self.senders = OrderedDict()  # phone -> [tokens, updated, last notice]
+        self.global_tokens = global_burst
+        self.global_updated = time.monotonic()
+        self.lock = Lock()
+        self.counts = {"admitted": 0, "shed_sender": 0, "shed_global": 0, "notices": 0}
+
+    @staticmethod
+    def cost(msg):
+        if msg.get("type") != "text":
+            return 1
+        body = (msg.get("text") or {}).get("body") or ""
+        stripped = body.strip()
+        return LOOKUP_COST if detect_warranty_token(stripped) or BARCODE_RE.match(stripped) else 1
+
+    def admit(self, msg):
+        """None if the message may proceed, else why it was shed ("sender" or "global")"""
+        frm, cost = msg["from"], self.cost(msg)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.senders.get(frm)
+            if bucket is None:
+                bucket = self.senders[frm] = [self.sender_burst, now, 0]
+                while len(self.senders) > self.max_senders:
+                    self.senders.popitem(last=False)
+            else:
+                self.senders.move_to_end(frm)
+                bucket[0] = min(self.sender_burst, bucket[0] + (now - bucket[1]) * self.sender_rate)
+                bucket[1] = now
+            self.global_tokens = min(self.global_burst, self.global_tokens + (now - self.global_updated) * self.global_rate)
+            self.global_updated = now
+            if bucket[0] < cost:
+                reason = "sender"
+            elif self.global_tokens < cost:
+                reason = "global"
+            else:
+                bucket[0] -= cost
+                self.global_tokens -= cost
+                self.counts["admitted"] += 1
+                return None
+            self.counts["shed_" + reason] += 1
+            notify = now - bucket[2] >= THROTTLE_NOTICE_INTERVAL
+            if notify:
+                bucket[2] = now
+                self.counts["notices"] += 1
+        admission_shed.inc(reason)
+        logger.warning(f"SHED ({reason}): {frm} | {msg.get('type')}")
+        if notify:
+            send_template("slow_down", None, frm)
+        return reason
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, senders=len(self.senders), global_tokens=round(self.global_tokens, 1))
+
+admission = AdmissionControl(SENDER_RATE, SENDER_BURST, GLOBAL_RATE, GLOBAL_BURST, ADMISSION_MAX_SENDERS)
 
 # ==================== FLASK APP ====================
+class BotRequest(Request):
+    """Caps webhook bodies while Werkzeug reads them, so a chunked one is never read whole.
+
+    Werkzeug stops a chunked body at the cap without an error, so the cap is one byte past
+    WEBHOOK_MAX_BYTES and a body that reaches it is the oversized one.
+    """
+
+    @property
+    def max_content_length(self):
+        return WEBHOOK_MAX_BYTES + 1 if self.path == "/webhook" else super().max_content_length
+
 app = Flask(__name__)
+app.request_class = BotRequest
 
 @app.get("/")
 def home(): 
     return "GAJA BOT LIVE - MERGED (WARRANTY + CASHBACK + FIXED FLOW)", 200
 
+@app.get("/ready")
+def ready():
+    """Readiness for the load balancer: fails while warming up, draining or if the job workers died"""
+    if draining.is_set():
+        return "draining", 503
+    if warmup.pending():
+        return "warming up", 503
+    if job_queue.workers > 0 and not all(t.is_alive() for t in job_queue.threads):
+        return "job workers down", 503
+    return "ready", 200
+
 @app.get("/webhook")
 def verify():
     if request.args.get("hub.mode") == "subscribe" and request.args.get("hub.verify_token") == VERIFY_TOKEN:
         return request.args.get("hub.challenge"), 200
     return "Forbidden", 403
 
+@app.before_request
+def track_request_start():
+    metrics.request_started()
+
+@app.teardown_request
+def track_request_end(exc):
+    metrics.request_finished()
+
 @app.post("/webhook")
 def webhook():
-    data = request.get_json() or {}
-
-    # Early duplicate detection
-    msg_id = None
+    started = time.perf_counter()
     try:
-        entry = data.get("entry", [])
-        if entry:
-            changes = entry[0].get("changes", [])
-            if changes:
-                value = changes[0].get("value", {})
-                messages = value.get("messages", [])
-                if messages:
-                    msg_id = messages[0].get("id")
-    except Exception as e:
-        logger.warning(f"Error extracting message ID: {e}")
-
-    if msg_id and already_seen(msg_id):
+        return handle_delivery()
+    finally:
+        if warmup.pending():
+            warmup.served_cold()  # kept out of the latency histogram, which describes a warm instance
+        else:
+            webhook_seconds.observe(time.perf_counter() - started)
+
+# Byte-level markers of the two keys worth parsing for. A string value can never match,
+# since quotes inside JSON strings are escaped, and "field": "messages" has no colon after it.
+MESSAGES_KEY_RE = re.compile(rb'"messages"\s*:')
+STATUSES_KEY_RE = re.compile(rb'"statuses"\s*:')
+
+def classify_delivery(raw):
+    """Payload class of a webhook body from its raw bytes, without parsing it"""
+    if not raw:
+        return "empty"
+    if MESSAGES_KEY_RE.search(raw):
+        return "messages"
+    if STATUSES_KEY_RE.search(raw):
+        return "statuses"
+    return "ignored"
+
+def handle_delivery():
+    if draining.is_set():
+        return "Shutting down", 503  # Meta redelivers, to whichever instance is ready
+    try:
+        raw = request.get_data()  # read no further than one byte past WEBHOOK_MAX_BYTES (BotRequest)
+    except RequestEntityTooLarge:  # the Content-Length alone was over
+        raw = None
+    if raw is None or len(raw) > WEBHOOK_MAX_BYTES:
+        webhook_payloads.inc("oversized")
+        return "Payload Too Large", 413
+    kind = classify_delivery(raw) if request.is_json else "ignored"
+    if kind not in ("messages", "statuses"):
+        webhook_payloads.inc(kind)
+        return "ok", 200
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):  # broken JSON and JSON that is not an object are the same error
+        webhook_payloads.inc("malformed")
+        return "Bad Request", 400
+    webhook_payloads.inc(kind)
+    if kind == "statuses":
+        for entry in data.get("entry", []):
+            for change in entry.get("changes", []):
+                for status in change.get("value", {}).get("statuses", []):
+                    deliveries.on_status(status)
         return "ok", 200
 
+    # Split the delivery into one job per new message, keyed by sender so each sender's
+    # turns run in order while different senders are handled in parallel
+    received_at = time.time()
+    delivered, messages = [], []
     for entry in data.get("entry", []):
         for change in entry.get("changes", []):
             value = change.get("value", {})
-            if "messages" not in value:
-                continue
-            msg = value["messages"][0]
-            frm = msg["from"]
-            s = get_session(frm)
-            logger.info(f"FROM {frm} | TYPE {msg['type']} | STATE {s.get('state')} | LANG {s.get('lang')}")
-
-            # If no language set, force language selection (unless it's a language selection button)
-            if s.get("lang") is None:
-                # If this is a language selection button
-                if msg["type"] == "interactive" and "button_reply" in msg["interactive"]:
-                    btn = msg["interactive"]["button_reply"]["id"]
-                    if btn.startswith("lang_"):
-                        s["lang"] = "en" if btn == "lang_en" else "ta"
-                        s["state"] = "main"
-                        save_session(frm, s)
-                        main_menu(frm, s["lang"])
-                        return "ok", 200
-
-                # If this is a WARRANTY TOKEN (GAJA + 8 chars)
-                if msg["type"] == "text":
-                    token = detect_warranty_token(msg["text"]["body"])
-                    if token:
-                        handle_warranty_start(frm, s, token)
-                        return "ok", 200
-
-                # Not language selection or warranty token -> show language menu
-                ask_language(frm)
-                return "ok", 200
-
-            # Handle interactive button replies (after language set)
-            if msg["type"] == "interactive" and "button_reply" in msg["interactive"]:
-                btn = msg["interactive"]["button_reply"]["id"]
-
-                if btn == "main_customer":
-                    s["state"] = "main"
-                    save_session(frm, s)
-                    customer_menu(frm, s["lang"])
-
-                elif btn == "main_carpenter":
-                    s["state"] = "main"
-                    save_session(frm, s)
-                    carpenter_menu(frm, s["lang"])
-
-                elif btn == "main_talk":
-                    send_text(frm, "Thank you! We'll call you soon." if s["lang"]=="en" else "நன்றி! விரைவில் அழைக்கிறோம்.")
-                    main_menu(frm, s["lang"])
-
-                elif btn == "cust_catalog":
-                    if CATALOG_URL:
-                        status = "📄 Sending catalogue..." if s["lang"]=="en" else "📄 கேட்டலாக் அனுப்பப்படுகிறது..."
-                        send_text(frm, status)
-                        send_document(frm, CATALOG_URL, caption="Latest GAJA Catalogue", filename=CATALOG_FILENAME)
-                        confirm = "✅ Catalogue sent successfully!" if s["lang"]=="en" else "✅ கேட்டலாக் வெற்றிகரமாக அனுப்பப்பட்டது!"
-                        send_text(frm, confirm)
-                    else:
-                        error = f"❌ Catalogue temporarily unavailable.\nPlease call {GAJA_PHONE}" if s["lang"]=="en" else f"❌ கேட்டலாக் தற்காலிகமாக கிடைக்கவில்லை.\nதயவுசெய்து {GAJA_PHONE} அழைக்கவும்"
-                        send_text(frm, error)
-                    customer_menu(frm, s["lang"])
-
-                elif btn in ["back_to_main", "cust_back"]:
-                    s["state"] = "main"
-                    save_session(frm, s)
-                    main_menu(frm, s["lang"])
-
-                elif btn == "carp_register":
-                    reg_msg = (
-                        f"📝 *Carpenter Registration*\n\n"
-                        f"To register as a GAJA Carpenter, please contact:\n\n"
-                        f"📞 GAJA Service: {GAJA_SERVICE}\n\n"
-                        f"Our team will assist you with the registration process!"
-                    ) if s["lang"]=="en" else (
-                        f"📝 *கார்பென்டர் பதிவு*\n\n"
-                        f"GAJA கார்பென்டராக பதிவு செய்ய, தொடர்பு கொள்ளவும்:\n\n"
-                        f"📞 GAJA சேவை: {GAJA_SERVICE}\n\n"
-                        f"எங்கள் குழு உங்களுக்கு பதிவு செயல்முறையில் உதவும்!"
-                    )
-                    send_text(frm, reg_msg)
-                    carpenter_menu(frm, s["lang"])
-
-                elif btn == "carp_cashback":
-                    s["state"] = "awaiting_code"
-                    save_session(frm, s)
-                    ask_carpenter_code(frm, s["lang"])
-
-                elif btn == "carp_scheme":
-                    if SCHEME_IMAGES:
-                        status = "📸 Sending scheme details..." if s["lang"]=="en" else "📸 ஸ்கீம் விவரங்கள் அனுப்பப்படுகிறது..."
-                        send_text(frm, status)
-                        for url in SCHEME_IMAGES[:5]:
-                            send_image(frm, url)
-                        confirm = "✅ Scheme details sent!" if s["lang"]=="en" else "✅ ஸ்கீம் விவரங்கள் அனுப்பப்பட்டது!"
-                        send_text(frm, confirm)
-                    else:
-                        error = f"❌ Scheme images unavailable.\nPlease call {GAJA_PHONE}" if s["lang"]=="en" else f"❌ ஸ்கீம் படங்கள் கிடைக்கவில்லை.\nதயவுசெய்து {GAJA_PHONE} அழைக்கவும்"
-                        send_text(frm, error)
-                    carpenter_menu(frm, s["lang"])
-
-                # Warranty-related buttons (from KISS flow)
-                if btn == "warr_care":
-                    if s.get("warranty_product"):
-                        send_care_instructions(frm, s["lang"], s["warranty_product"])
-                    else:
-                        send_text(frm, "No product info available." if s.get("lang") == "en" else "பொருள் தகவல் இல்லை.")
-                    return "ok", 200
-
-                if btn == "warr_tc":
-                    send_warranty_tc(frm, s["lang"])
-                    return "ok", 200
-
-                if btn == "warr_close":
-                    goodbye = "Thank you for choosing GAJA! 🙏" if s.get("lang") == "en" else "GAJA-வை தேர்ந்தெடுத்ததற்கு நன்றி! 🙏"
-                    send_text(frm, goodbye)
-                    with lock:
-                        if frm in sessions:
-                            del sessions[frm]
-                    return "ok", 200
-
-                return "ok", 200
-
-            # List reply (month selection)
-            if msg["type"] == "interactive" and msg["interactive"].get("type") == "list_reply":
-                list_id = msg["interactive"]["list_reply"]["id"]
-                if s.get("state") == "awaiting_month":
-                    handle_month_selection(frm, s, list_id)
-                return "ok", 200
-
-            # Text message handling
-            if msg["type"] == "text":
-                text_raw = msg["text"]["body"]
-                text = text_raw.strip().lower()
-
-                # If user sends GAJA token at any time (language already set)
-                token = detect_warranty_token(text_raw)
-                if token:
-                    handle_warranty_start(frm, s, token)
-                    return "ok", 200
-
-                # Force end session commands
-                if text in ["exit", "close", "quit", "bye", "stop"]:
-                    with lock:
-                        if frm in sessions:
-                            del sessions[frm]
-                    goodbye = (
-                        "👋 Session ended. Thank you for contacting GAJA!\n\nType 'hi' anytime to restart."
-                    ) if s.get("lang") == "en" else (
-                        "👋 உரையாடல் முடிந்தது. GAJA-வை தொடர்பு கொண்டதற்கு நன்றி!\n\nமீண்டும் தொடங்க 'hi' என தட்டச்சு செய்யவும்."
-                    )
-                    send_text(frm, goodbye)
-                    logger.info(f"SESSION ENDED by user: {frm}")
-                    return "ok", 200
-
-                # Reset / menu commands
-                if text in ["0", "menu", "back", "main", "home"]:
-                    s["state"] = "main"
-                    save_session(frm, s)
-                    main_menu(frm, s["lang"])
-                    return "ok", 200
-
-                # Fresh start commands
-                if text in ["hi", "hello", "start"]:
-                    s = {"lang": None, "state": "start"}
-                    save_session(frm, s)
-                    ask_language(frm)
-                    return "ok", 200
-
-                # Warranty barcode input flow
-                if s.get("state") == "awaiting_barcode":
-                    handle_barcode_input(frm, s, text_raw)
-                    return "ok", 200
-
-                # Carpenter code input flow
-                if s.get("state") == "awaiting_code":
-                    handle_carpenter_code(frm, s, text_raw)
-                    return "ok", 200
-
-                # Default fallback
-                fallback = (
-                    "I didn't understand that. 🤔\n\nHere's the main menu:"
-                ) if s["lang"]=="en" else (
-                    "புரியவில்லை. 🤔\n\nஇதோ முகப்பு மெனு:"
-                )
-                send_text(frm, fallback)
-                main_menu(frm, s["lang"])
-                return "ok", 200
-
+            for status in value.get("statuses", []):
+                deliveries.on_status(status)
+            delivered.extend(value.get("messages", []))
+    batch_stats.record(delivered)
+    for msg in delivered:
+        if msg.get("from") and not already_seen(msg.get("id")) and admission.admit(msg) is None:
+            messages.append(msg)
+
+    messages.sort(key=lambda m: message_ts(m, received_at))
+    for n, msg in enumerate(messages):
+        job = {"message": msg, "received_at": received_at}
+        try:
+            job_queue.enqueue(json.dumps(job), key=msg["from"], ts=message_ts(msg, received_at))
+        except Exception:
+            for unqueued in messages[n:]:
+                dedup.forget(unqueued.get("id"))  # not journaled: Meta's redelivery must get through
+            raise
     return "ok", 200
 
+def message_ts(msg, default):
+    """The message's epoch timestamp, or `default` when Meta's is missing or malformed"""
+    try:
+        ts = float(msg.get("timestamp"))
+    except (TypeError, ValueError):
+        return default
+    return ts if math.isfinite(ts) and ts > 0 else default
+
+class BatchStats:
+    """Distribution of messages and distinct senders per webhook delivery"""
+
+    BUCKETS = (0, 1, 2, 3, 5, 10, 25)
+
+    def __init__(self):
+        self.lock = Lock()
+        self.deliveries = 0
+        self.messages = dict.fromkeys(self.BUCKETS + ("more",), 0)
+        self.senders = dict.fromkeys(self.BUCKETS + ("more",), 0)
+
+    def _bucket(self, n):
+        return next((b for b in self.BUCKETS if n <= b), "more")
+
+    def record(self, messages):
+        with self.lock:
+            self.deliveries += 1
+            self.messages[self._bucket(len(messages))] += 1
+            self.senders[self._bucket(len({m.get("from") for m in messages}))] += 1
+
+    def stats(self):
+        with self.lock:
+            return {"deliveries": self.deliveries,
+                    "messages_le": {str(k): v for k, v in self.messages.items()},
+                    "senders_le": {str(k): v for k, v in self.senders.items()}}
+
+batch_stats = BatchStats()
+
+@app.get("/stats")
+def stats():
+    return {
+        "jobs": job_queue.stats(),
+        "batches": batch_stats.stats(),
+        "payloads": {values[0]: n for values, n in list(webhook_payloads.children.items())},
+        "admission": admission.stats(),
+        "http": http_client.stats(),
+        "dedup": dedup.stats(),
+        "sessions": session_store.stats(),
+        "cache": api_cache.stats(),
+        "apps_script": api_guard.stats(),
+        "warranty_journal": warranty_journal.stats(),
+        "replica": replica.stats(),
+        "startup": warmup.stats(),
+        "logging": log_pipeline.stats(),
+        "pumble": pumble.stats(),
+        "outbound": outbound.stats(),
+        "campaigns": campaigns.stats(),
+        "media": media.stats(),
+        "deliveries": deliveries.stats(),
+        "handlers": flow.stats(),
+    }, 200
+
+@app.get("/metrics")
+def prometheus_metrics():
+    body = metrics.render({
+        "jobs": job_queue.stats(),
+        "dedup": dedup.stats(),
+        "admission": admission.stats(),
+        "sessions": session_store.stats(),
+        "cache": api_cache.stats(),
+        "pumble": pumble.stats(),
+        "outbound": outbound.stats(),
+        "campaigns": campaigns.stats(),
+        "media": media.stats(),
+        "deliveries": deliveries.stats(),
+        "warranty_journal": warranty_journal.stats(),
+        "startup": warmup.stats(),
+        "logging": log_pipeline.stats(),
+    })
+    return body, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+def is_admin():
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {ADMIN_TOKEN}")
+
+@app.post("/campaigns")
+def create_campaign():
+    """Start a broadcast: {"name", "recipients": [phone or {"phone", "lang"}], "messages": [...] or {lang: [...]}}"""
+    if not is_admin():
+        return {"error": "forbidden"}, 403
+    if campaigns.workers <= 0:
+        return {"error": "campaigns are disabled (CAMPAIGN_WORKERS=0)"}, 503
+    data = request.get_json(silent=True) or {}
+    try:
+        return campaigns.create(data.get("name"), data.get("recipients"), data.get("messages")), 201
+    except CampaignError as e:
+        return {"error": str(e)}, 400
+
+@app.get("/campaigns")
+def list_campaigns():
+    if not is_admin():
+        return {"error": "forbidden"}, 403
+    return {"campaigns": campaigns.reports()}, 200
+
+@app.get("/campaigns/<int:campaign_id>")
+def campaign_report(campaign_id):
+    if not is_admin():
+        return {"error": "forbidden"}, 403
+    report = campaigns.report(campaign_id)
+    return (report, 200) if report else ({"error": "not found"}, 404)
+
+@app.post("/campaigns/<int:campaign_id>/<action>")
+def campaign_action(campaign_id, action):
+    if not is_admin():
+        return {"error": "forbidden"}, 403
+    status = {"pause": "paused", "resume": "running", "cancel": "cancelled"}.get(action)
+    if status is None:
+        return {"error": f"unknown action {action}"}, 404
+    report = campaigns.set_status(campaign_id, status)
+    return (report, 200) if report else ({"error": f"cannot {action} campaign {campaign_id}"}, 409)
+
+def process_job(job):
+    """Job worker entry point: one inbound message"""
+    turn.received_at = job.get("received_at")
+    try:
+        handle_message(job["message"])
+    finally:
+        turn.received_at = None
+
+job_queue = JobQueue(JOB_DB_PATH, process_job, JOB_WORKERS)
+job_queue.start()
+
+# ==================== WARMUP ====================
+class Warmup:
+    """Startup phases that pay the cold-start costs before the first real user does.
+
+    Run in the background once the server is listening: /ready fails until every phase has
+    finished (or WARMUP_TIMEOUT passed), so the load balancer only routes traffic to a warm
+    instance. A failing phase is logged and skipped, it never keeps the instance unready.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.started_at = None
+        self.finished = Event()
+        self.phases = {}  # name -> ms, in run order
+        self.failed = []
+        self.cold_deliveries = 0
+        self.ready_at = None
+        self.lock = Lock()
+
+    def pending(self):
+        return self.started_at is not None and not self.finished.is_set() and time.time() - self.started_at < self.timeout
+
+    def served_cold(self):
+        with self.lock:
+            self.cold_deliveries += 1
+
+    def _imports(self):
+        mimetypes.init()  # guess_type() would otherwise read the system MIME tables on the first media upload
+        with app.test_request_context("/webhook", method="POST", json={"entry": []}):
+            request.get_json()
+
+    def _connections(self):
+        if not PHONE_ID:
+            return
+        def probe(_):
+            http_client.get(f"{GRAPH}/{PHONE_ID}", headers=HEADERS, timeout=10, retry=False).close()
+        if io_pool is None:
+            probe(0)
+        else:
+            list(io_pool.map(probe, range(WARMUP_CONNECTIONS)))
+
+    def _reference_data(self):
+        # fetch_months() also opens the pooled connection(s) to Apps Script and its redirect host
+        if fetch_months() is None:
+            raise RuntimeError("months lookup failed")
+        if replica.interval > 0 and APPS_URL:
+            replica.first_round.wait(max(0, self.started_at + self.timeout - time.time()))
+            unsynced = [name for name, t in replica.tables.items() if t.synced_at is None]
+            if unsynced:
+                raise RuntimeError(f"replica not synced: {', '.join(unsynced)}")
+
+    def _templates(self):
+        for template in templates.templates.values():
+            template.render(**{slot: "0" for slot in template.slots})
+
+    def run(self):
+        for name, phase in (("imports", self._imports), ("templates", self._templates),
+                            ("connections", self._connections), ("reference_data", self._reference_data)):
+            started = time.perf_counter()
+            try:
+                phase()
+            except Exception as e:
+                self.failed.append(name)
+                logger.warning(f"WARMUP: {name} failed: {e}")
+            self.phases[name] = round((time.perf_counter() - started) * 1000, 1)
+            logger.info(f"WARMUP: {name} {self.phases[name]:.0f}ms")
+        self.ready_at = time.time()
+        self.finished.set()
+        logger.info(f"STARTUP: ready in {self.ready_at - PROCESS_STARTED:.2f}s | "
+                    f"init {self.started_at - PROCESS_STARTED:.2f}s | warmup {self.ready_at - self.started_at:.2f}s")
+
+    def start(self):
+        self.started_at = time.time()
+        if WARMUP:
+            Thread(target=self.run, name="warmup", daemon=True).start()
+        else:
+            self.ready_at = self.started_at
+            self.finished.set()
+
+    def stats(self):
+        with self.lock:
+            return {"ready": int(self.finished.is_set()),
+                    "init_seconds": round(self.started_at - PROCESS_STARTED, 2) if self.started_at else None,
+                    "warmup_seconds": round(self.ready_at - self.started_at, 2) if self.ready_at else None,
+                    "phases_ms": dict(self.phases), "failed": list(self.failed),
+                    "cold_deliveries": self.cold_deliveries}
+
+warmup = Warmup(WARMUP_TIMEOUT)
+
+# ==================== SERVING ====================
+draining = Event()  # set on SIGTERM: webhooks get 503 and /ready fails while work drains
+
+def drain(grace):
+    """Finish in-flight turns, then their outbound sends and Pumble events, within `grace` seconds"""
+    deadline = time.time() + grace
+    turns_done = job_queue.drain(max(0, deadline - time.time()))
+    if WARRANTY_WRITE_BEHIND:
+        warranty_journal.flush(max(0, deadline - time.time()))
+    campaigns.stop(max(0, deadline - time.time()))
+    sends_done = outbound.drain(max(0, deadline - time.time()))
+    pumble.flush(max(0, deadline - time.time()))
+    if turns_done and sends_done:
+        logger.info("SHUTDOWN: drained cleanly")
+    else:
+        logger.warning(f"SHUTDOWN: grace period over | jobs {job_queue.stats()['depth']} queued (journaled for replay) | sends {outbound.stats()['depth']} queued")
+
+def serve(port):
+    server = create_server(app, host="0.0.0.0", port=port, threads=WEB_THREADS,
+                           connection_limit=WEB_CONNECTION_LIMIT, backlog=WEB_BACKLOG,
+                           channel_timeout=WEB_CHANNEL_TIMEOUT, ident="gaja-bot")
+
+    def finish():
+        drain(SHUTDOWN_GRACE)
+        os.kill(os.getpid(), signal.SIGTERM)  # wake the main thread to stop the server
+
+    def on_signal(signum, frame):
+        if draining.is_set():
+            raise SystemExit(0)  # drain finished (or a second signal): end server.run()
+        logger.info(f"SHUTDOWN: signal {signum}, draining for up to {SHUTDOWN_GRACE:.0f}s")
+        draining.set()
+        Thread(target=finish, name="shutdown-drain", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    logger.info(f"SERVING on :{port} | {WEB_THREADS} threads | {WEB_CONNECTION_LIMIT} connections | backlog {WEB_BACKLOG}")
+    warmup.start()
+    server.run()
+    logger.info("SHUTDOWN: complete")
+    log_pipeline.stop()
+
 if __name__ == "__main__":
-    port = int(os.getenv("PORT", 10000))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    serve(int(os.getenv("PORT", 10000)))
@@ -0,0 +1,70 @@
+# bench/bench_logging.py - logging cost per turn on the request thread: synchronous vs queued
+#
+# A "turn" logs what a typical warranty turn does: one inbound line, three sends and one
+# plain message. The legacy case formats f-strings and writes them from the caller, like the
+# old logging.basicConfig setup; the pipeline case goes through log_event / LogPipeline with
+# the writer thread draining to the same sink. Both write to os.devnull.
+#
+# Usage: python bench/bench_logging.py [turns]
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("JOB_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench_jobs.db"))
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("OUTBOUND_WORKERS", "0")
+os.environ.setdefault("REPLICA_SYNC_INTERVAL", "0")
+
+import app  # noqa: E402
+
+FRM = "919876543210"
+
+def legacy_logger(sink):
+    log = logging.Logger("legacy")
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    log.addHandler(handler)
+    return log
+
+def legacy_turn(log):
+    log.info(f"FROM {FRM} | TYPE text | STATE awaiting_barcode | LANG en")
+    for kind in ("text", "text", "interactive"):
+        log.info(f"SENT to {FRM} | {kind}")
+    log.info(f"WARRANTY REGISTERED: ABCD2345 | {FRM} | SKU 12")
+
+def pipeline_turn():
+    app.log_event("inbound", frm=FRM, type="text", state="awaiting_barcode", lang="en")
+    for kind in ("text", "text", "interactive"):
+        app.log_event("sent", to=FRM, type=kind)
+    app.logger.info(f"WARRANTY REGISTERED: ABCD2345 | {FRM} | SKU 12")
+
+def run(turn, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        turn()
+    return (time.perf_counter() - started) / n * 1e6
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    sink = open(os.devnull, "w")
+    legacy = legacy_logger(sink)
+    print(f"{'case':<34}{'caller us/turn':>16}{'end-to-end us/turn':>20}")
+    old = run(lambda: legacy_turn(legacy), n)
+    print(f"{'legacy (sync, f-strings)':<34}{old:>16.2f}{old:>20.2f}")
+
+    for fmt in ("json", "text"):
+        for label, sample in (("no sampling", {}), ("default sampling", app.LOG_SAMPLE)):
+            pipeline = app.LogPipeline(fmt, 0, sample, stream=sink)  # unbounded: nothing dropped
+            pipeline.start()
+            app.log_pipeline = pipeline
+            started = time.perf_counter()
+            caller = run(pipeline_turn, n)
+            pipeline.stop()  # returns once the writer thread has drained the queue
+            total = (time.perf_counter() - started) / n * 1e6
+            print(f"{f'pipeline {fmt}, {label}':<34}{caller:>16.2f}{total:>20.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# bench/bench_templates.py - per-call payload construction vs pre-encoded templates
+#
+# Usage: python bench/bench_templates.py [iterations]
+import os
+import sys
+import json
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("JOB_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench_jobs.db"))
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("OUTBOUND_WORKERS", "0")
+os.environ.setdefault("REPLICA_SYNC_INTERVAL", "0")
+
+import app  # noqa: E402
+
+TO = "919876543210"
+
+def legacy_main_menu(to, lang):
+    """main_menu() as it was before templates: build the dict, then encode it like requests does"""
+    body = "Welcome! How can we help you today?" if lang == "en" else "வணக்கம்! எப்படி உதவலாம்?"
+    payload = app.buttons_payload(to, body, [
+        {"id": "main_customer", "title": "Customer" if lang=="en" else "வாடிக்கையாளர்"},
+        {"id": "main_carpenter", "title": "Carpenter" if lang=="en" else "கார்பென்டர்"},
+        {"id": "main_talk", "title": "Talk to Us" if lang=="en" else "பேச வேண்டுமா?"}
+    ])
+    return json.dumps(payload, allow_nan=False).encode("utf-8")
+
+def legacy_cashback(to, lang):
+    name, month, amt = "Ravi", "Feb 2026", 500
+    msg = f"Hello {name}!\n\nCashback for {month}: ₹{amt}\n\nTransferred by month end.\nCall {app.GAJA_PHONE} for queries." if lang=="en" else f"வணக்கம் {name}!\n\n{month} கேஷ்பேக்: ₹{amt}\n\nமாத இறுதிக்குள் வரவு வைக்கப்படும்.\n{app.GAJA_PHONE} அழைக்கவும்."
+    return json.dumps(app.text_payload(to, msg), allow_nan=False).encode("utf-8")
+
+def template_main_menu(to, lang):
+    return app.templates.render("main_menu", lang, to).body
+
+def template_cashback(to, lang):
+    return app.templates.render("cashback_result", lang, to, name="Ravi", month="Feb 2026", amount=500).body
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # both paths must produce the same JSON document
+    for lang in ("en", "ta"):
+        assert json.loads(legacy_main_menu(TO, lang)) == json.loads(template_main_menu(TO, lang))
+        assert json.loads(legacy_cashback(TO, lang)) == json.loads(template_cashback(TO, lang))
+
+    print(f"{'case':<24}{'legacy us/op':>14}{'template us/op':>16}{'speedup':>10}")
+    for name, legacy, template in [("main_menu", legacy_main_menu, template_main_menu),
+                                   ("cashback_result", legacy_cashback, template_cashback)]:
+        for lang in ("en", "ta"):
+            old = min(timeit.repeat(lambda: legacy(TO, lang), number=n, repeat=3)) / n * 1e6
+            new = min(timeit.repeat(lambda: template(TO, lang), number=n, repeat=3)) / n * 1e6
+            print(f"{name + ' [' + lang + ']':<24}{old:>14.2f}{new:>16.2f}{old / new:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
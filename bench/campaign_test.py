@@ -0,0 +1,115 @@
+# bench/campaign_test.py - broadcast campaign end to end against the local Graph stand-in
+#
+# Runs app.py as a subprocess against FakeGraph, starts a campaign through POST /campaigns
+# and waits for it to finish. With --crash-at the bot is killed (SIGKILL, or SIGTERM with
+# --graceful) once that share of messages went out, then restarted; the campaign must resume
+# on its own. Afterwards every recipient's messages at Graph are counted: nobody may get a
+# message twice, and everyone not reported failed/unknown must have all of them.
+#
+# Usage: python bench/campaign_test.py [--recipients 2000] [--graph-rate 60] [--graph-limit 80]
+#        [--graph-latency-ms 80] [--crash-at 0.4] [--graceful]
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+
+import requests
+from fake_graph import FakeGraph
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ADMIN = "bench-admin"
+
+def start_bot(env, log):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py")], env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{env['PORT']}"
+    for _ in range(300):
+        try:
+            if requests.get(url + "/ready", timeout=1).status_code == 200:
+                return proc, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("bot never became ready")
+
+def report(url, campaign_id):
+    return requests.get(f"{url}/campaigns/{campaign_id}", headers={"Authorization": f"Bearer {ADMIN}"}, timeout=5).json()
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast campaign test against FakeGraph")
+    parser.add_argument("--recipients", type=int, default=2000)
+    parser.add_argument("--graph-rate", type=float, default=60, help="GRAPH_RATE the bot is configured with")
+    parser.add_argument("--graph-limit", type=int, default=80, help="messages/second FakeGraph accepts")
+    parser.add_argument("--graph-latency-ms", type=float, default=80)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--crash-at", type=float, default=None, help="kill the bot after this share of messages")
+    parser.add_argument("--graceful", action="store_true", help="SIGTERM instead of SIGKILL at --crash-at")
+    parser.add_argument("--port", type=int, default=18600)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    graph = FakeGraph(latency_ms=args.graph_latency_ms, rate_limit=args.graph_limit).start()
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, GRAPH_URL=graph.url, PHONE_NUMBER_ID="bench", ACCESS_TOKEN="bench", APPS_SCRIPT_URL="",
+               JOB_DB_PATH=os.path.join(workdir, "bench_jobs.db"), PORT=str(args.port), ADMIN_TOKEN=ADMIN,
+               REPLICA_SYNC_INTERVAL="0", GRAPH_RATE=str(args.graph_rate), GRAPH_BURST=str(int(args.graph_rate)),
+               CAMPAIGN_WORKERS=str(args.workers), SHUTDOWN_GRACE="10")
+    env.pop("PUMBLE_WEBHOOK_URL", None)
+    log = open(os.path.join(workdir, "bot.log"), "w")
+
+    proc, url = start_bot(env, log)
+    phones = [str(919100000000 + i) for i in range(args.recipients)]
+    messages = [{"text": "New GAJA scheme is live! Reply hi to see it."},
+                {"image": f"{graph.url}/assets/scheme1.png", "caption": "GAJA carpenter scheme"}]
+    created = requests.post(f"{url}/campaigns", headers={"Authorization": f"Bearer {ADMIN}"}, timeout=60,
+                            json={"name": "bench", "recipients": phones, "messages": messages})
+    if created.status_code != 201:
+        raise SystemExit(f"create failed: {created.status_code} {created.text}")
+    campaign_id = created.json()["id"]
+    expected = len(phones) * len(messages)
+    started = time.time()
+    restarted = False
+
+    deadline = started + args.timeout
+    while time.time() < deadline:
+        time.sleep(0.5)
+        if args.crash_at is not None and not restarted and len(graph.messages) >= expected * args.crash_at:
+            proc.send_signal(signal.SIGTERM if args.graceful else signal.SIGKILL)
+            proc.wait(30)
+            proc, url = start_bot(env, log)
+            restarted = True
+        if report(url, campaign_id)["status"] == "done":
+            break
+    elapsed = time.time() - started
+    final = report(url, campaign_id)
+    stats = requests.get(f"{url}/stats", timeout=5).json()
+    proc.send_signal(signal.SIGTERM)
+    proc.wait(30)
+
+    counts = {phone: len(graph.reply_times(phone)) for phone in phones}
+    result = {
+        "recipients": len(phones),
+        "messages_expected": expected,
+        "graph_messages": len(graph.messages),
+        "graph_refused_over_limit": graph.over_limit,
+        "restarted": restarted,
+        "elapsed_s": round(elapsed, 1),
+        "messages_per_s": round(len(graph.messages) / elapsed, 1),
+        "duplicated_recipients": sum(1 for n in counts.values() if n > len(messages)),
+        "incomplete_recipients": sum(1 for n in counts.values() if n < len(messages)),
+        "report": final,
+        "media_uploads": graph.uploads,
+        "campaign_stats": stats["campaigns"],
+    }
+    print(json.dumps(result, indent=2))
+    not_done = final["recipients"]["failed"] + final["recipients"]["unknown"]
+    if final["status"] != "done" or result["duplicated_recipients"] or result["incomplete_recipients"] > not_done:
+        print(f"FAILED (bot log: {log.name})")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# bench/fake_apps_script.py - local stand-in for the GAJA Apps Script API
+#
+# Answers every action the bot calls (GET ?action=...):
+#   verify_token, register_warranty, lookup_barcode, get_care_instructions,
+#   months, cashback, export_products, export_care, export_cashback, export_tokens
+# against a small generated catalogue: barcodes 500000..500000+products-1, carpenter codes
+# CARP0000..CARPnnnn, and `tokens` issued warranty tokens (listed in .tokens).
+# Latency and error rate are configurable, per-action call counts are kept.
+#
+# Usage: python bench/fake_apps_script.py [--port 8082] [--latency-ms 300] [--error-rate 0.01]
+#        then start the bot with APPS_SCRIPT_URL=http://127.0.0.1:8082/exec
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+CATEGORIES = ["Hinges", "Channels", "Handles", "Locks"]
+MONTHS = ["Jan 2026", "Feb 2026", "Mar 2026"]
+TOKEN_CHARS = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
+class FakeAppsScript:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0, error_rate=0.0, products=500, carpenters=200,
+                 tokens=20000):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.calls = {}  # action -> count
+        self.registered = set()  # tokens already used
+        self.products = {str(500000 + i): {"code": str(500000 + i), "sku_name": f"SKU {i}",
+                                           "category": CATEGORIES[i % len(CATEGORIES)]}
+                         for i in range(products)}
+        self.carpenters = [f"CARP{i:04d}" for i in range(carpenters)]
+        rng = random.Random(42)
+        self.tokens = ["".join(rng.choice(TOKEN_CHARS) for _ in range(8)) for _ in range(tokens)]
+        self.issued = set(self.tokens)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/exec"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-apps-script", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, action, q):
+        """The JSON body Apps Script would return for one call"""
+        if action == "verify_token":
+            token = q.get("token", "")
+            return {"valid": token in self.issued, "available": token not in self.registered}
+        if action == "register_warranty":
+            with self.lock:
+                if q.get("token") in self.registered:
+                    return {"success": False, "error": "Token already used"}
+                self.registered.add(q.get("token"))
+            return {"success": True, "warranty_months": 12, "expiry_date": "2027-01-01"}
+        if action == "lookup_barcode":
+            product = self.products.get(q.get("code", "").strip())
+            return dict(product, found=True) if product else {"found": False}
+        if action == "get_care_instructions":
+            return {"care_instructions": f"Keep {q.get('category', 'it')} dry and clean."}
+        if action == "months":
+            return {"months": MONTHS}
+        if action == "cashback":
+            if q.get("code", "").strip().upper() not in self.carpenters:
+                return {"found": False}
+            return {"found": True, "name": "Carpenter", "cashback_amount": 250}
+        if action == "export_products":
+            return {"rows": list(self.products.values()), "as_of": "v1", "full": True}
+        if action == "export_care":
+            return {"rows": [{"category": c, "care_instructions": f"Keep {c} dry and clean."} for c in CATEGORIES],
+                    "as_of": "v1", "full": True}
+        if action == "export_tokens":
+            with self.lock:
+                redeemed = list(self.registered)
+            return {"issued": self.tokens, "redeemed": redeemed, "as_of": "v1", "full": True}
+        if action == "export_cashback":
+            return {"rows": [{"code": c, "month": m, "name": "Carpenter", "cashback_amount": 250}
+                             for c in self.carpenters for m in MONTHS], "as_of": "v1", "full": True}
+        return {"error": f"Unknown action {action}"}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, obj):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                action = q.get("action", "")
+                with fake.lock:
+                    fake.calls[action] = fake.calls.get(action, 0) + 1
+                if fake.latency_ms:
+                    time.sleep(random.uniform(0.5, 1.5) * fake.latency_ms / 1000)
+                if random.random() < fake.error_rate:
+                    return self._reply(500, {"error": "Service invoked too many times"})
+                self._reply(200, fake.answer(action, q))
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the GAJA Apps Script API")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeAppsScript(port=args.port, latency_ms=args.latency_ms, error_rate=args.error_rate)
+    print(f"Fake Apps Script listening on {fake.url}")
+    fake.server.serve_forever()
+
+if __name__ == "__main__":
+    main()
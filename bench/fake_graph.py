@@ -0,0 +1,155 @@
+# bench/fake_graph.py - local stand-in for the WhatsApp Graph API
+#
+# Serves just enough of Graph for the bot to run against it:
+#   POST /<phone_id>/messages  -> {"messages": [{"id": "wamid.N"}]}
+#   POST /<phone_id>/media     -> {"id": "media.N"}   (multipart upload)
+#   GET  /assets/<name>        -> sample bytes, used as the "hosted" catalogue/scheme files
+# Media IDs can be forgotten (forget_media) to exercise the bot's re-upload path, and
+# latency / error / throttle rates are configurable. With a rate limit, messages beyond it
+# per second are refused with Graph's throughput error (130429), as a real phone number is.
+#
+# Usage: python bench/fake_graph.py [--port 8081] [--latency-ms 50] [--error-rate 0.01] [--rate-limit 80]
+#        then start the bot with GRAPH_URL=http://127.0.0.1:8081
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakeGraph:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0, error_rate=0.0, throttle_rate=0.0, rate_limit=0):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit  # messages/second accepted, 0 = unlimited
+        self.window = (0, 0)  # (second, messages accepted in it)
+        self.over_limit = 0
+        self.lock = threading.Lock()
+        self.messages = []  # (received_at, payload)
+        self.by_to = {}  # recipient -> [received_at, ...], for cheap per-user polling
+        self.media = {}  # media_id -> (mime, size)
+        self.uploads = 0
+        self.counter = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-graph", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def forget_media(self):
+        """Drop every uploaded media ID, as if they had expired on Meta's side"""
+        with self.lock:
+            self.media.clear()
+
+    def sent_to(self, to):
+        with self.lock:
+            return [p for _, p in self.messages if p.get("to") == to]
+
+    def reply_times(self, to):
+        """Arrival times of every message sent to `to` so far"""
+        with self.lock:
+            return list(self.by_to.get(to, ()))
+
+    def _admit(self):
+        """False if this message would exceed rate_limit in the current second"""
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            second, n = self.window
+            now = int(time.time())
+            if now != second:
+                second, n = now, 0
+            if n >= self.rate_limit:
+                self.over_limit += 1
+                return False
+            self.window = (second, n + 1)
+            return True
+
+    def _next_id(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f"{prefix}.{self.counter}"
+
+    def _handler(self):
+        graph = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, obj, content_type="application/json"):
+                body = obj if isinstance(obj, bytes) else json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith("/assets/"):
+                    name = self.path.rsplit("/", 1)[-1]
+                    mime = "application/pdf" if name.endswith(".pdf") else "image/png"
+                    return self._reply(200, b"%PDF-1.4 fake" if mime == "application/pdf" else b"\x89PNG fake", mime)
+                self._reply(404, {"error": {"message": "Unknown path", "code": 100}})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if graph.latency_ms:
+                    time.sleep(random.uniform(0.5, 1.5) * graph.latency_ms / 1000)
+                if self.path.endswith("/media"):
+                    media_id = graph._next_id("media")
+                    with graph.lock:
+                        graph.media[media_id] = (self.headers.get("Content-Type"), len(body))
+                        graph.uploads += 1
+                    return self._reply(200, {"id": media_id})
+                if not self.path.endswith("/messages"):
+                    return self._reply(404, {"error": {"message": "Unknown path", "code": 100}})
+                roll = random.random()
+                if roll < graph.throttle_rate or not graph._admit():
+                    return self._reply(429, {"error": {"message": "Rate limit hit", "code": 130429}})
+                if roll < graph.throttle_rate + graph.error_rate:
+                    return self._reply(500, {"error": {"message": "Internal error", "code": 1}})
+                payload = json.loads(body)
+                kind = payload.get("type")
+                media_id = (payload.get(kind) or {}).get("id") if kind in ("image", "document") else None
+                with graph.lock:
+                    known = media_id is None or media_id in graph.media
+                if not known:
+                    return self._reply(400, {"error": {"message": "Media upload error", "code": 131053}})
+                with graph.lock:
+                    now = time.time()
+                    graph.messages.append((now, payload))
+                    graph.by_to.setdefault(payload.get("to"), []).append(now)
+                self._reply(200, {"messaging_product": "whatsapp", "messages": [{"id": graph._next_id("wamid")}]})
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the WhatsApp Graph API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=0)
+    args = parser.parse_args()
+    graph = FakeGraph(port=args.port, latency_ms=args.latency_ms, error_rate=args.error_rate,
+                      throttle_rate=args.throttle_rate, rate_limit=args.rate_limit)
+    print(f"Fake Graph listening on {graph.url}")
+    graph.server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# bench/load_test.py - end-to-end load test of app.py against local Graph / Apps Script stand-ins
+#
+# Starts FakeGraph and FakeAppsScript, serves app.app on a local port, then runs --users
+# virtual users for --duration seconds. Each user plays whole conversations picked from
+# SCENARIOS (language pick, warranty token + barcode, guessed tokens, carpenter cashback,
+# catalogue, batched "hi" deliveries), with some deliveries re-posted as Meta retries would.
+#
+# A turn's latency is measured from the webhook POST to the last reply Graph received
+# for that user before they went quiet for --quiet-ms; a turn with no reply within
+# --turn-timeout is counted as stalled. Results can be saved and compared against a
+# previous run, exiting 1 when throughput or p95 latency regress beyond --tolerance.
+#
+# Usage: python bench/load_test.py [--users 20] [--duration 30] [--graph-latency-ms 80]
+#        [--apps-latency-ms 300] [--apps-error-rate 0] [--dup-rate 0.05] [--replica]
+#        [--save results.json] [--baseline results.json] [--tolerance 0.15]
+import os
+import sys
+import json
+import time
+import logging
+import random
+import argparse
+import tempfile
+import itertools
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests  # noqa: E402
+from fake_graph import FakeGraph  # noqa: E402
+from fake_apps_script import FakeAppsScript  # noqa: E402
+
+phones = itertools.count(919000000000)
+message_ids = itertools.count(1)
+
+def text(body):
+    return {"type": "text", "text": {"body": body}}
+
+def button(button_id):
+    return {"type": "interactive", "interactive": {"type": "button_reply", "button_reply": {"id": button_id}}}
+
+def list_reply(row_id):
+    return {"type": "interactive", "interactive": {"type": "list_reply", "list_reply": {"id": row_id}}}
+
+ISSUED_TOKENS = []  # filled from FakeAppsScript.tokens
+
+def warranty_steps(rng):
+    token = rng.choice(ISSUED_TOKENS)
+    return [text("hi"), button("lang_en"), text(f"GAJA {token}"), text(str(500000 + rng.randrange(500)))]
+
+def guessed_token_steps(rng):
+    token = "".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ23456789") for _ in range(8))
+    return [text("hi"), button("lang_en"), text(f"GAJA {token}")]
+
+SCENARIOS = {
+    # name: (weight, steps factory)
+    "language": (3, lambda rng: [text("hi"), button(rng.choice(["lang_en", "lang_ta"])), text("bye")]),
+    "warranty": (3, warranty_steps),
+    "guessed_token": (1, guessed_token_steps),
+    "cashback": (2, lambda rng: [text("hi"), button("lang_en"), button("main_carpenter"), button("carp_cashback"),
+                                 text(f"CARP{rng.randrange(200):04d}"), list_reply(f"month_{rng.randrange(3)}")]),
+    "catalogue": (2, lambda rng: [text("hi"), button("lang_en"), button("main_customer"), button("cust_catalog")]),
+    "batch": (1, None),  # several new users' opening "hi" in one delivery
+}
+
+def delivery(*messages):
+    return {"object": "whatsapp_business_account",
+            "entry": [{"changes": [{"value": {"messaging_product": "whatsapp", "messages": list(messages)}}]}]}
+
+def inbound(phone, step):
+    return dict(step, id=f"wamid.bench{next(message_ids)}", timestamp=str(int(time.time())), **{"from": phone})
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns = {}  # scenario -> [last-reply latency ms]
+        self.first = []  # first-reply latency ms
+        self.acks = []  # webhook POST round trip ms
+        self.stalled = 0
+        self.duplicates = 0
+        self.http_errors = 0
+        self.conversations = 0
+
+    def turn(self, scenario, first_ms, last_ms):
+        with self.lock:
+            self.turns.setdefault(scenario, []).append(last_ms)
+            self.first.append(first_ms)
+
+    def add(self, field, n=1):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + n)
+
+class VirtualUser(threading.Thread):
+    def __init__(self, n, bot_url, graph, recorder, args, deadline):
+        super().__init__(name=f"user-{n}", daemon=True)
+        self.rng = random.Random(args.seed * 1000 + n)
+        self.http = requests.Session()
+        self.bot_url = bot_url
+        self.graph = graph
+        self.recorder = recorder
+        self.args = args
+        self.deadline = deadline
+        names = list(SCENARIOS)
+        self.names, self.weights = names, [SCENARIOS[k][0] for k in names]
+
+    def post(self, body):
+        started = time.time()
+        try:
+            r = self.http.post(self.bot_url, json=body, timeout=30)
+            if r.status_code != 200:
+                self.recorder.add("http_errors")
+        except requests.RequestException:
+            self.recorder.add("http_errors")
+        self.recorder.acks.append((time.time() - started) * 1000)
+        if self.rng.random() < self.args.dup_rate:
+            self.recorder.add("duplicates")
+            try:
+                self.http.post(self.bot_url, json=body, timeout=30)
+            except requests.RequestException:
+                self.recorder.add("http_errors")
+        return started
+
+    def wait_turn(self, phone, seen, posted_at):
+        """(first, last) reply latency in ms once the bot has gone quiet, None if it never answered"""
+        timeout_at = posted_at + self.args.turn_timeout
+        quiet = self.args.quiet_ms / 1000
+        while True:
+            times = self.graph.reply_times(phone)
+            now = time.time()
+            if len(times) > seen:
+                if now - times[-1] >= quiet:
+                    return (times[seen] - posted_at) * 1000, (times[-1] - posted_at) * 1000, len(times)
+            elif now > timeout_at:
+                return None
+            time.sleep(0.005)
+
+    def conversation(self, scenario):
+        if scenario == "batch":
+            group = [str(next(phones)) for _ in range(self.rng.randint(2, 5))]
+            posted_at = self.post(delivery(*[inbound(p, text("hi")) for p in group]))
+            for phone in group:
+                result = self.wait_turn(phone, 0, posted_at)
+                if result is None:
+                    self.recorder.add("stalled")
+                else:
+                    self.recorder.turn(scenario, result[0], result[1])
+            return
+        phone = str(next(phones))
+        seen = 0
+        for step in SCENARIOS[scenario][1](self.rng):
+            if time.time() > self.deadline:
+                return
+            posted_at = self.post(delivery(inbound(phone, step)))
+            result = self.wait_turn(phone, seen, posted_at)
+            if result is None:
+                self.recorder.add("stalled")
+                return
+            first_ms, last_ms, seen = result
+            self.recorder.turn(scenario, first_ms, last_ms)
+            time.sleep(self.rng.uniform(0, self.args.think_ms / 1000))
+
+    def run(self):
+        while time.time() < self.deadline:
+            self.conversation(self.rng.choices(self.names, self.weights)[0])
+            self.recorder.add("conversations")
+
+def summarise(values):
+    from app import percentile
+    return {"n": len(values), "p50": round(percentile(values, 50), 1),
+            "p95": round(percentile(values, 95), 1), "p99": round(percentile(values, 99), 1)}
+
+def compare(result, baseline, tolerance):
+    """Printable regressions of result vs baseline (empty when within tolerance)"""
+    problems = []
+    if result["turns_per_s"] < baseline["turns_per_s"] * (1 - tolerance):
+        problems.append(f"throughput {result['turns_per_s']} turns/s vs baseline {baseline['turns_per_s']}")
+    p95, base_p95 = result["turn_ms"]["p95"], baseline["turn_ms"]["p95"]
+    if base_p95 and p95 > base_p95 * (1 + tolerance):
+        problems.append(f"p95 turn latency {p95} ms vs baseline {base_p95} ms")
+    if result["stalled"] > baseline["stalled"]:
+        problems.append(f"{result['stalled']} stalled turns vs baseline {baseline['stalled']}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test app.py against local Graph / Apps Script stand-ins")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to generate traffic for")
+    parser.add_argument("--graph-latency-ms", type=float, default=80)
+    parser.add_argument("--graph-error-rate", type=float, default=0.0)
+    parser.add_argument("--graph-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--apps-latency-ms", type=float, default=300)
+    parser.add_argument("--apps-error-rate", type=float, default=0.0)
+    parser.add_argument("--dup-rate", type=float, default=0.05, help="share of deliveries re-posted as a Meta retry")
+    parser.add_argument("--think-ms", type=float, default=500, help="max pause between a user's turns")
+    parser.add_argument("--quiet-ms", type=float, default=None, help="silence that ends a turn (default 2x Apps Script latency + 200)")
+    parser.add_argument("--turn-timeout", type=float, default=15)
+    parser.add_argument("--replica", action="store_true", help="serve lookups from the local replica")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results JSON here")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression vs --baseline")
+    args = parser.parse_args()
+    if args.quiet_ms is None:
+        args.quiet_ms = 2 * args.apps_latency_ms + 200
+
+    graph = FakeGraph(latency_ms=args.graph_latency_ms, error_rate=args.graph_error_rate,
+                      throttle_rate=args.graph_throttle_rate).start()
+    apps = FakeAppsScript(latency_ms=args.apps_latency_ms, error_rate=args.apps_error_rate).start()
+    ISSUED_TOKENS.extend(apps.tokens)
+    os.environ.update(
+        GRAPH_URL=graph.url, APPS_SCRIPT_URL=apps.url, PHONE_NUMBER_ID="bench", ACCESS_TOKEN="bench",
+        JOB_DB_PATH=os.path.join(tempfile.mkdtemp(), "bench_jobs.db"),
+        REPLICA_SYNC_INTERVAL="3600" if args.replica else "0",
+        CATALOG_URL=f"{graph.url}/assets/catalogue.pdf",
+    )
+    os.environ.pop("PUMBLE_WEBHOOK_URL", None)
+
+    import app
+    from werkzeug.serving import make_server
+    for name in (app.logger.name, "werkzeug"):
+        logging.getLogger(name).setLevel(logging.WARNING)  # per-message INFO lines would dominate the run
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bot", daemon=True).start()
+    bot_url = f"http://127.0.0.1:{server.server_port}/webhook"
+
+    recorder = Recorder()
+    started = time.time()
+    deadline = started + args.duration
+    users = [VirtualUser(n, bot_url, graph, recorder, args, deadline) for n in range(args.users)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join(args.duration + args.turn_timeout + 30)
+    elapsed = time.time() - started
+
+    all_turns = [ms for values in recorder.turns.values() for ms in values]
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "baseline")},
+        "elapsed_s": round(elapsed, 1),
+        "conversations": recorder.conversations,
+        "turns": len(all_turns),
+        "stalled": recorder.stalled,
+        "duplicates_posted": recorder.duplicates,
+        "http_errors": recorder.http_errors,
+        "turns_per_s": round(len(all_turns) / elapsed, 2),
+        "graph_messages_per_s": round(len(graph.messages) / elapsed, 2),
+        "turn_ms": summarise(all_turns),
+        "first_reply_ms": summarise(recorder.first),
+        "webhook_ack_ms": summarise(recorder.acks),
+        "by_scenario": {name: summarise(values) for name, values in sorted(recorder.turns.items())},
+        "apps_script_calls": dict(sorted(apps.calls.items())),
+        "outbound": app.outbound.stats(),
+        "jobs": app.job_queue.stats(),
+    }
+    print(json.dumps(result, indent=2))
+    server.shutdown()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+        print("No regression against baseline")
+
+if __name__ == "__main__":
+    main()